@@ -1,11 +1,15 @@
 import board
 import digitalio
+import pwmio
 import wifi
 import socketpool
 import os
 import time
-import adafruit_dht
 from iot_sdk import IoTDevice
+from iot_runtime import Runtime
+from iot_sampling import Sampler
+from iot_sensors import SensorRegistry, DHTDriver
+from iot_buffer import TelemetryBuffer
 import led_paterns
 
 # ================= HARDWARE SETUP =================
@@ -23,28 +27,74 @@ for r in relays.values():
     r.direction = digitalio.Direction.OUTPUT
     r.value = 1  # 1 = OFF (because active LOW)
 
+# Dimmable PWM outputs (LED strip driver, fan controller...), level 0-100 %
+dimmers = {
+    "dimmer1": pwmio.PWMOut(board.GP14, frequency=1000, duty_cycle=0),
+}
+dimmer_levels = {name: 0 for name in dimmers}
+
 # Onboard LED (status indicator)
 devled = digitalio.DigitalInOut(board.GP15)
 devled.direction = digitalio.Direction.OUTPUT
+leds = led_paterns.LedEngine(devled)
+
+# Sensors: each driver measures without blocking and counts its own errors
+sensors = SensorRegistry()
+# DHT11 temperature & humidity sensor (use dht22=True for a DHT22)
+sensors.add(DHTDriver(board.GP3, keys=("temp", "humi")), interval=2, delay=2)  # 2 s to stabilize
+
+
+# ================= SAMPLING =================
 
-# DHT11 temperature & humidity sensor
-dht11_sensor = adafruit_dht.DHT11(board.GP3)
-time.sleep(2)  # Give sensor time to stabilize
+telemetry_interval = 20  # seconds between reports (min/max/mean/last/count)
+
+# Readings from the sensor registry are pushed into the report windows
+sampler = Sampler()
+sampler.add("temp")
+sampler.add("humi")
+sensors.on_reading = sampler.push
 
 
 # ================= HANDEL COMMANDS  =================
 
+# Apply one command to the matching relay or dimmer, False if it can't be applied
+def apply_command(command, value):
+    if command in relays:
+        if str(value).lower() == "on":
+            relays[command].value = 0  # Turn relay ON
+        elif str(value).lower() == "off":
+            relays[command].value = 1  # Turn relay OFF
+        else:
+            return False
+
+    elif command in dimmers:
+        try:
+            level = min(100, max(0, int(float(value))))
+        except ValueError:
+            return False
+        dimmers[command].duty_cycle = level * 65535 // 100
+        dimmer_levels[command] = level
+
+    else:
+        return False
+    return True
+
+
 # Function to handle incoming MQTT commands
 def handle_commands(command, value):
     print(f"MQTT Command: {command} -> {value}")
+    apply_command(command, value)
 
-    # Only act if command matches a relay name
-    if command in relays:
-        if value.lower() == "on":
-            relays[command].value = 0  # Turn relay ON
-        elif value.lower() == "off":
-            relays[command].value = 1  # Turn relay OFF
 
+# Function to handle scenes: several relays switched from a single MQTT message
+def handle_scene(commands):
+    print(f"MQTT Scene: {commands}")
+
+    # Set every pin in one pass so the relays change together
+    failed = [command for command, value in commands.items() if not apply_command(command, value)]
+    if failed:
+        # Reported to the app in the scene ack
+        raise ValueError(f"could not apply {', '.join(failed)}")
 
 
 
@@ -66,8 +116,9 @@ try:
     time.sleep(2)
     print("Connected! IP:", wifi.radio.ipv4_address)
 except Exception as e:
+    # Not fatal: the SDK re-associates from device.update()
     print("WiFi Error:", e)
-    led_paterns.fast(devled)
+    leds.show("fast", priority=1, repeat=5)
 
 # Create socket pool for networking
 pool = socketpool.SocketPool(wifi.radio)
@@ -78,70 +129,97 @@ pool = socketpool.SocketPool(wifi.radio)
 device = IoTDevice(
     device_id="pico_01",
     broker="192.168.1.9",
-    pool=pool
+    pool=pool,
+    wifi_ssid=ssid,
+    wifi_password=password,
+    # Short socket waits: the MQTT task must hand back control quickly
+    socket_timeout=0.1,
+    loop_timeout=0.1,
 )
 
 # Assign command handler
 device.on_command_received = handle_commands
+device.on_scene_received = handle_scene
+
+# Capability manifest: the app creates the matching cards by itself
+device.describe("temp", unit="°C", min=0, max=50, name="Temperature")
+device.describe("humi", unit="%", min=20, max=90, name="Humidity")
+for name in relays:
+    device.describe(name, kind="relay", type="str")
+for name in dimmers:
+    device.describe(name, kind="dimmer", type="int", min=0, max=100)
+sampler.describe_stats(device)
+# Seconds since each sensor's last good reading (null before the first one)
+for key in sensors.sources:
+    device.describe(f"{key}_age", kind="stat", type="int", unit="s")
 
 print("Connecting to MQTT broker...")
-try:
-    device.connect()
+if device.connect():
     print("MQTT Connected!")
-except Exception as e:
-    print("MQTT Error:", e)
-    led_paterns.sos(devled)
+else:
+    print("MQTT not reachable yet, retrying in the background")
 
 
-# ================= MAIN LOOP =================
+# ================= TASKS =================
+
+# Telemetry is written into one preallocated packet, no dict or JSON string per send.
+# Values go out as a compact array in manifest field order.
+telemetry = device.telemetry_encoder()
+
+# Frames that can't be sent during an outage wait here (64 x 20 s = 21 min of data)
+# and are replayed 10 at a time after the reconnect.
+# Add spill_path="/telemetry.bin" to keep more on flash (needs a writable filesystem).
+backlog = TelemetryBuffer(telemetry, capacity=64, batch=10)
+
+
+# Extra counters for the diagnostics report (devices/pico_01/diag, once a minute)
+def diagnostics():
+    sensor_errors = sum(h["errors"] for h in sensors.health().values())
+    return {"buf": backlog.pending(), "drop": backlog.dropped, "sens_err": sensor_errors}
+
 
-last_telemetry_time = 0
-telemetry_interval = 5  # seconds
+device.diag.extra = diagnostics
 
-while True:
-    # Keep MQTT alive
+
+# Last good reading of a sensor key, None before the first one
+def last_reading(key):
+    return sensors.reading(key)[0]
+
+
+# Send the aggregates of the last interval with the relay/dimmer states, runs on its own task
+def send_telemetry():
     try:
-        device.update()
+        # A failing or warming-up sensor doesn't stop the report: its aggregates are
+        # null (n=0) and its last good reading goes out with its age, the relay/dimmer
+        # states are always sent and keep the device alive on the hub
+        if not sampler.report(telemetry, fallback=last_reading):
+            print("No new samples, sending the last good readings")
+        for key in sensors.sources:
+            age = sensors.reading(key)[1]
+            telemetry.set(f"{key}_age", None if age is None else int(age))
+        for name in relays:
+            telemetry.set(name, "on" if relays[name].value == 0 else "off")
+        for name in dimmers:
+            telemetry.set(name, dimmer_levels[name])
+
+        # Send data to MQTT server (buffered while reconnecting)
+        if telemetry.send():
+            print("Sent telemetry", device.seq)
+        elif backlog.pending():
+            print("Buffered telemetry", backlog.pending())
+
     except Exception as e:
-        print("MQTT lost, reconnecting...", e)
-        
-        try:
-            device.reconnect()
-        except:
-            pass
+        # Signal it on top of the status pattern, the device keeps running
+        print("Telemetry Error:", e)
+        leds.show("slow", priority=2, repeat=3)
 
-    current_time = time.monotonic()
 
-    # Send telemetry every X seconds
-    if current_time - last_telemetry_time >= telemetry_interval:
-        try:
-            # Read temperature and humidity
-            temp = dht11_sensor.temperature
-            humi = dht11_sensor.humidity
-
-            if temp is not None and humi is not None:
-                sensor_data = {
-                    "temp": temp ,
-                    "humi": humi,
-                    "relay1": "on" if relays["relay1"].value == 0 else "off",
-                    "relay2": "on" if relays["relay2"].value == 0 else "off",
-                    "relay3": "on" if relays["relay3"].value == 0 else "off",
-                    "relay4": "on" if relays["relay4"].value == 0 else "off",
-                }
-
-                # Send data to MQTT server
-                device.send_telemetry(sensor_data)
-                print(f"Sent: {temp}°C, {humi}%")
-
-        except RuntimeError:
-            # Normal DHT error (ignore and retry next cycle)
-            dht11_sensor.exit()
-            dht11_sensor = adafruit_dht.DHT11(board.GP3)
-
-        except Exception as e:
-            print("Telemetry Error:", e)
-            led_paterns.slow(devled)
-
-        last_telemetry_time = current_time
-
-    time.sleep(0.1)
\ No newline at end of file
+# ================= MAIN LOOP =================
+
+# MQTT I/O, command handling, the status LED and telemetry each run as
+# their own task, so a sensor read never delays a relay command
+runtime = Runtime(device, status_led=leds)
+runtime.every(0.1, sensors.poll)  # each sensor keeps its own interval
+runtime.every(telemetry_interval, send_telemetry)
+runtime.every(1, backlog.flush)  # at most one batch per second after an outage
+runtime.run()
@@ -0,0 +1,207 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+# iot_buffer.py
+# -------------------------
+# Offline telemetry buffer for iot_sdk.TelemetryEncoder.
+# While MQTT is down, frames are kept as small binary records in a fixed RAM
+# ring (optionally spilling the oldest ones to a flash file) and sent back
+# in rate-limited batches after the reconnect, with their original timestamps.
+# Usage: telemetry = device.telemetry_encoder()
+#        backlog = TelemetryBuffer(telemetry, capacity=64)
+#        telemetry.send()                      # buffers by itself when offline
+#        backlog.flush()                       # every second (main loop or a task)
+# Flash spill needs a writable filesystem (storage.remount("/", False) in boot.py).
+
+import json
+import struct
+
+NAN = float("nan")
+MAX_STRINGS = 32  # distinct string values kept (states like "on"/"off"), others are stored as None
+
+
+class TelemetryBuffer:
+    """
+    Record layout (little endian): ts int64 ms, flags uint8 (bit 0: synced),
+    seq uint32, then one float32 per encoder field (NaN for None). Strings are
+    stored as an index into a small table, bools and ints are restored from the
+    kind seen for each field.
+
+    While anything is pending, new frames are queued behind it so the hub
+    receives them in sequence order.
+    """
+
+    def __init__(self, encoder, capacity=64, batch=10, spill_path=None, spill_max=1024):
+        self.encoder = encoder
+        self.device = encoder.device
+        self.format = "<qBI" + "f" * len(encoder.fields)
+        self.size = struct.calcsize(self.format)
+        self.ram = bytearray(capacity * self.size)
+        self.capacity = capacity
+        self.head = 0  # oldest record in RAM
+        self.count = 0
+        self.batch = batch
+        self.kinds = [None] * len(encoder.fields)  # "s", "b", "i" or "f" per field
+        self.strings = []  # index -> string
+        self.string_ids = {}  # string -> index
+
+        # Flash spill: records pushed out of RAM, oldest first, read from spill_read on
+        self.spill_path = spill_path
+        self.spill_max = spill_max
+        self.spilled = 0
+        self.spill_read = 0
+        if spill_path:
+            self._truncate()  # records of a previous boot have a stale seq/boot id
+
+        self.stored = 0
+        self.flushed = 0
+        self.dropped = 0
+        encoder.buffer = self
+
+    def pending(self):
+        return self.count + self.spilled
+
+    # ---------------- Storing ----------------
+    def _pack(self, buf, offset):
+        ts, synced = self.device.timestamp()
+        values = self.encoder.values
+        kinds = self.kinds
+        packed = []
+        for i in range(len(values)):
+            value = values[i]
+            if value is None:
+                packed.append(NAN)
+                continue
+            if isinstance(value, str):
+                index = self.string_ids.get(value)
+                if index is None:
+                    if len(self.strings) == MAX_STRINGS:
+                        packed.append(NAN)
+                        continue
+                    index = self.string_ids[value] = len(self.strings)
+                    self.strings.append(value)
+                kinds[i] = "s"
+                value = index
+            elif value is True or value is False:
+                kinds[i] = "b"
+            elif isinstance(value, int):
+                kinds[i] = "i"
+            else:
+                kinds[i] = "f"
+            packed.append(value)
+        struct.pack_into(self.format, buf, offset, ts, 1 if synced else 0, self.device.seq, *packed)
+
+    def store(self):
+        """Keeps the encoder's current values as one record, taking the next sequence number."""
+        if self.count == self.capacity:
+            if not self._spill():
+                self.dropped += 1  # the oldest record is overwritten
+                self.head = (self.head + 1) % self.capacity
+                self.count -= 1
+        self._pack(self.ram, ((self.head + self.count) % self.capacity) * self.size)
+        self.count += 1
+        self.stored += 1
+        self.device.seq += 1
+
+    # ---------------- Flash spill ----------------
+    def _spill(self):
+        """Moves the oldest RAM record to the flash file. False without spill or when it fails/is full."""
+        if not self.spill_path or self.spill_read + self.spilled >= self.spill_max:
+            return False
+        start = self.head * self.size
+        try:
+            with open(self.spill_path, "ab") as f:
+                f.write(self.ram[start:start + self.size])
+        except OSError as e:
+            print(f"Buffer: flash spill disabled: {e}")
+            self.spill_path = None
+            return False
+        self.spilled += 1
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        return True
+
+    def _truncate(self):
+        try:
+            with open(self.spill_path, "wb"):
+                pass
+        except OSError as e:
+            print(f"Buffer: flash spill disabled: {e}")
+            self.spill_path = None
+        self.spilled = 0
+        self.spill_read = 0
+
+    def _read_spill(self, n):
+        with open(self.spill_path, "rb") as f:
+            f.seek(self.spill_read * self.size)
+            return f.read(n * self.size)
+
+    # ---------------- Flushing ----------------
+    def _frame(self, buf, offset):
+        fields = struct.unpack_from(self.format, buf, offset)
+        ts, flags, seq = fields[0], fields[1], fields[2]
+        clock = self.device.clock
+        if not flags & 1 and clock.synced():
+            ts = clock.to_hub_time(ts)  # stored before the first sync
+            flags = 1
+        values = []
+        for i, kind in enumerate(self.kinds):
+            value = fields[3 + i]
+            if value != value:
+                values.append(None)
+            elif kind == "s":
+                values.append(self.strings[int(value)])
+            elif kind == "b":
+                values.append(bool(value))
+            elif kind == "i":
+                values.append(int(value))
+            else:
+                values.append(round(value, self.encoder.DECIMALS))
+        frame = {"ts": ts, "sync": bool(flags & 1), "seq": seq}
+        if self.encoder.compact:
+            frame["v"] = values
+        else:
+            frame["data"] = dict(zip(self.encoder.fields, values))
+        return frame
+
+    def flush(self):
+        """
+        Sends up to `batch` of the oldest records as one message. Call it at the
+        rate the broker should see after a reconnect. Returns the number sent.
+        """
+        device = self.device
+        if not self.pending() or device.state != "connected":
+            return 0
+
+        frames = []
+        from_spill = 0
+        if self.spilled:
+            data = self._read_spill(min(self.batch, self.spilled))
+            from_spill = len(data) // self.size
+            for i in range(from_spill):
+                frames.append(self._frame(data, i * self.size))
+        from_ram = min(self.batch - len(frames), self.count)
+        for i in range(from_ram):
+            frames.append(self._frame(self.ram, ((self.head + i) % self.capacity) * self.size))
+
+        payload = {"boot": device.boot_id, "batch": frames}
+        if self.encoder.compact:
+            payload["mv"] = device.manifest_version()
+        if not device._publish(f"devices/{device.id}/telemetry", json.dumps(payload)):
+            return 0
+
+        # Sent: drop the records
+        if from_spill:
+            self.spill_read += from_spill
+            self.spilled -= from_spill
+            if not self.spilled:
+                self._truncate()
+        self.head = (self.head + from_ram) % self.capacity
+        self.count -= from_ram
+        self.flushed += len(frames)
+        return len(frames)
+
+    def stats(self):
+        return {
+            "pending": self.pending(), "spilled": self.spilled, "stored": self.stored,
+            "flushed": self.flushed, "dropped": self.dropped,
+        }
@@ -0,0 +1,155 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+# iot_runtime.py
+# -------------------------
+# Cooperative asyncio runtime for iot_sdk.IoTDevice.
+# Needs the `asyncio` library from the CircuitPython bundle (with adafruit_ticks).
+# Usage: (set device.on_command_received / on_scene_received first)
+#        runtime = Runtime(device, status_led=devled)
+#        runtime.every(5, read_sensors)
+#        runtime.run()
+
+import asyncio
+import time
+
+from led_paterns import LedEngine
+
+
+class Periodic:
+    """A function run every `interval` seconds on its own task. Sync or async."""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.errors = 0
+        self.late = 0  # runs that started more than one interval behind
+
+    async def run(self):
+        next_run = time.monotonic()
+        while True:
+            try:
+                result = self.func()
+                if result is not None and hasattr(result, "send"):
+                    await result
+            except Exception as e:
+                self.errors += 1
+                print(f"Runtime: {self.name} failed: {e}")
+            self.runs += 1
+
+            # Fixed cadence: the next run is planned from the previous deadline
+            next_run += self.interval
+            now = time.monotonic()
+            if now - next_run > self.interval:
+                self.late += 1
+                next_run = now
+            await asyncio.sleep(max(0, next_run - now))
+
+
+class Runtime:
+    """
+    Runs the device as separate tasks, each with its own cadence:
+
+    - mqtt: device.update() every `mqtt_interval` (keep loop_timeout short)
+    - commands: applies received commands and scenes as soon as they arrive
+    - led: status LED pattern engine (solid when connected, blinking while
+      reconnecting, other patterns can be queued on top through `leds`)
+    - one task per every() registration (sensor sampling, telemetry...)
+    """
+
+    def __init__(self, device, status_led=None, mqtt_interval=0.05):
+        self.device = device
+        # A LED pin or a LedEngine that is already set up
+        if status_led is not None and not isinstance(status_led, LedEngine):
+            status_led = LedEngine(status_led)
+        self.leds = status_led
+        self.mqtt_interval = mqtt_interval
+        self.periodic = []
+        self.extra = []
+
+        # Commands received during device.update() are handed to the command task,
+        # scenes are applied (and acknowledged) there too
+        self.on_command = device.on_command_received
+        self.queue = []
+        self.queued = asyncio.Event()
+        device.on_command_received = self._queue_command
+        device.on_scene_message = self._queue_scene
+        if device.on_scene_received is None and self.on_command:
+            device.on_scene_received = self._apply_commands
+        self.commands_applied = 0
+        self.max_command_delay = 0
+
+    def every(self, interval, func, name=None):
+        """Runs `func` every `interval` seconds on its own task."""
+        task = Periodic(name or getattr(func, "__name__", "task"), interval, func)
+        self.periodic.append(task)
+        return task
+
+    def task(self, coro):
+        """Adds any other coroutine to the runtime."""
+        self.extra.append(coro)
+
+    # ---------------- Commands ----------------
+    def _queue_command(self, command, value):
+        self.queue.append((time.monotonic(), command, value))
+        self.queued.set()
+
+    def _queue_scene(self, data):
+        self.queue.append((time.monotonic(), None, data))
+        self.queued.set()
+
+    async def _commands(self):
+        while True:
+            await self.queued.wait()
+            self.queued.clear()
+            while self.queue:
+                received, command, value = self.queue.pop(0)
+                try:
+                    if command is None:
+                        self.device.apply_scene(value)  # acks once applied, with the error if any
+                    elif self.on_command:
+                        self.on_command(command, value)
+                except Exception as e:
+                    print(f"Runtime: command {command} failed: {e}")
+                self.commands_applied += 1
+                self.max_command_delay = max(self.max_command_delay, time.monotonic() - received)
+
+    def _apply_commands(self, commands):
+        for command, value in commands.items():
+            self.on_command(command, value)
+
+    # ---------------- MQTT ----------------
+    async def _mqtt(self):
+        while True:
+            self.device.update()
+            await asyncio.sleep(self.mqtt_interval)
+
+    # ---------------- Status LED ----------------
+    async def _led(self):
+        leds = self.leds
+        state = None
+        while True:
+            if self.device.state != state:
+                state = self.device.state
+                leds.show("solid" if state == "connected" else "blink", name="status")
+            await asyncio.sleep(leds.tick() / 1000)
+
+    # ---------------- Run ----------------
+    def stats(self):
+        tasks = {p.name: {"runs": p.runs, "errors": p.errors, "late": p.late} for p in self.periodic}
+        return {"tasks": tasks, "commands": self.commands_applied, "max_command_delay": self.max_command_delay}
+
+    async def main(self):
+        tasks = [asyncio.create_task(self._mqtt()), asyncio.create_task(self._commands())]
+        if self.leds is not None:
+            tasks.append(asyncio.create_task(self._led()))
+        for periodic in self.periodic:
+            tasks.append(asyncio.create_task(periodic.run()))
+        for coro in self.extra:
+            tasks.append(asyncio.create_task(coro))
+        await asyncio.gather(*tasks)
+
+    def run(self):
+        """Runs forever."""
+        asyncio.run(self.main())
@@ -0,0 +1,160 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+# iot_sampling.py
+# -------------------------
+# Multi-rate sampling with windowed aggregates.
+# Each sensor is sampled at its own rate into a fixed-size array window, and
+# every report sends min/max/mean/last/count of the samples since the last one.
+# Usage: sampler = Sampler()
+#        sampler.add("temp", read_temp, period=2)
+#        sampler.add("humi")                   # fed with sampler.push("humi", value)
+#        sampler.describe_stats(device)        # aggregate fields in the manifest
+#        sampler.poll()                        # often (main loop or a task)
+#        sampler.report(telemetry); telemetry.send()
+
+import time
+from array import array
+
+STATS = ("min", "max", "last", "n")  # sent as <key>_<stat>, the mean is sent as <key>
+
+
+class Window:
+    """Samples of one reporting interval in a preallocated float array (oldest overwritten when full)."""
+
+    def __init__(self, size=32):
+        self.values = array("f", [0.0] * size)
+        self.size = size
+        self.count = 0
+        self.head = 0
+        self.last = None
+        self.overwritten = 0
+
+    def add(self, value):
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        else:
+            self.overwritten += 1
+        self.last = value
+
+    def aggregate(self):
+        """(min, max, mean, last, count) of the window, None when empty."""
+        n = self.count
+        if not n:
+            return None
+        values = self.values
+        lo = hi = total = values[0]
+        for i in range(1, n):
+            v = values[i]
+            if v < lo:
+                lo = v
+            if v > hi:
+                hi = v
+            total += v
+        return lo, hi, total / n, self.last, n
+
+    def reset(self):
+        self.count = 0
+        self.head = 0
+
+
+class Channel:
+    """One sensor value: `read()` returns a number or None, `period` in seconds (no `read`: pushed)."""
+
+    def __init__(self, key, read, period, size):
+        self.key = key
+        self.names = (key,) + tuple(f"{key}_{stat}" for stat in STATS)  # telemetry fields
+        self.read = read
+        self.period = period
+        self.window = Window(size)
+        self.next_sample = 0
+        self.samples = 0
+        self.errors = 0
+
+    def sample(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            self.errors += 1
+            print(f"Sampler: {self.key} read failed: {e}")
+            return
+        if value is not None:
+            self.window.add(value)
+            self.samples += 1
+
+
+class Sampler:
+    def __init__(self):
+        self.channels = []
+
+    def add(self, key, read=None, period=2, size=32):
+        """Samples `read()` every `period` seconds, keeping up to `size` samples per report.
+        Without `read` the channel only takes values given to push()."""
+        channel = Channel(key, read, period, size)
+        self.channels.append(channel)
+        return channel
+
+    def push(self, key, value):
+        """Adds a sample read elsewhere (e.g. by iot_sensors.SensorRegistry). Unknown keys are ignored."""
+        for channel in self.channels:
+            if channel.key == key:
+                if value is not None:
+                    channel.window.add(value)
+                    channel.samples += 1
+                return
+
+    def describe_stats(self, device):
+        """Adds the aggregate fields to the device manifest (the mean uses the key itself)."""
+        for channel in self.channels:
+            for name, stat in zip(channel.names[1:], STATS):
+                device.describe(name, kind="stat", type="int" if stat == "n" else "float")
+
+    def fields(self):
+        """Telemetry field names for an explicit TelemetryEncoder field list."""
+        names = []
+        for channel in self.channels:
+            names.extend(channel.names)
+        return names
+
+    def poll(self, now=None):
+        """Samples every channel that is due. Cheap to call often."""
+        now = time.monotonic() if now is None else now
+        for channel in self.channels:
+            if channel.read is not None and now >= channel.next_sample:
+                # Planned from the previous deadline so the rate doesn't drift
+                channel.next_sample += channel.period
+                if channel.next_sample <= now:
+                    channel.next_sample = now + channel.period  # fell behind, don't burst
+                channel.sample()
+
+    def report(self, telemetry, fallback=None):
+        """
+        Writes the aggregates into a TelemetryEncoder and starts new windows. False if nothing was sampled.
+        Channels without samples report n=0 and null aggregates, with `fallback(key)` (e.g. the last
+        good reading) as their value when given.
+        """
+        sampled = False
+        for channel in self.channels:
+            stats = channel.window.aggregate()
+            channel.window.reset()
+            if stats is None:
+                lo = hi = last = None
+                mean = fallback(channel.key) if fallback else None
+                n = 0
+            else:
+                lo, hi, mean, last, n = stats
+                sampled = True
+            key, key_min, key_max, key_last, key_n = channel.names
+            telemetry.set(key, mean)
+            telemetry.set(key_min, lo)
+            telemetry.set(key_max, hi)
+            telemetry.set(key_last, last)
+            telemetry.set(key_n, n)
+        return sampled
+
+    def stats(self):
+        return {
+            c.key: {"samples": c.samples, "errors": c.errors, "overwritten": c.window.overwritten}
+            for c in self.channels
+        }
@@ -1,78 +1,653 @@
+import gc
 import json
+import os
+import random
 import time
+import wifi
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
+from adafruit_ticks import ticks_ms
+
+
+def local_ms():
+    """Milliseconds since boot."""
+    return time.monotonic_ns() // 1000000
+
+
+class ClockSync:
+    """
+    NTP-style clock synchronisation with the hub over MQTT.
+    Each exchange gives t0 (request sent, our clock), t1/t2 (received/replied,
+    hub clock) and t3 (reply received, our clock). The sample with the lowest
+    round-trip delay among the last few gives the offset, and its drift since
+    the first good estimate (the anchor) gives the skew.
+    """
+
+    SAMPLES = 8
+    MAX_SKEW = 0.001  # 1000 ppm, anything larger is a bad estimate
+
+    def __init__(self, interval=60, fast_interval=5):
+        self.interval = interval * 1000
+        self.fast_interval = fast_interval * 1000
+        self.samples = []
+        self.offset = None
+        self.skew = 0.0
+        self.ref = 0
+        self.anchor = None
+        self.delay = None
+        self.last_delay = None  # round trip of the latest exchange (ms)
+        self.last_request = None
+        self.pending_t0 = None
+
+    def due(self, now):
+        # Poll quickly until a few samples are in, then settle down
+        interval = self.fast_interval if len(self.samples) < 4 else self.interval
+        return self.last_request is None or now - self.last_request >= interval
+
+    def request(self, now):
+        self.last_request = now
+        self.pending_t0 = now
+        return {"t0": now}
+
+    def on_reply(self, data, t3):
+        t0, t1, t2 = data.get("t0"), data.get("t1"), data.get("t2")
+        if t0 != self.pending_t0 or t1 is None or t2 is None:
+            return
+        self.pending_t0 = None
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) // 2
+        self.last_delay = delay
+        self.samples.append((delay, offset, t3))
+        if len(self.samples) > self.SAMPLES:
+            self.samples.pop(0)
+
+        delay, offset, at = min(self.samples)
+        if at == self.ref:
+            return
+        if self.anchor is None:
+            self.anchor = (offset, at)
+        elif at - self.anchor[1] > 60000:
+            skew = (offset - self.anchor[0]) / (at - self.anchor[1])
+            if -self.MAX_SKEW < skew < self.MAX_SKEW:
+                self.skew = skew
+        self.offset, self.ref, self.delay = offset, at, delay
+
+    def now_offset(self, local):
+        return self.offset + int(self.skew * (local - self.ref))
+
+    def synced(self):
+        return self.offset is not None
+
+    def to_hub_time(self, local):
+        """Converts a local millisecond timestamp to hub (epoch) milliseconds."""
+        return local + self.now_offset(local)
+
+
+class Diagnostics:
+    """
+    Device health between two reports, published on devices/<id>/diag:
+    time between update() calls (how long other work holds the loop), time
+    spent in client.loop, free heap, garbage collections (seen as the free
+    heap going up), Wi-Fi RSSI, reconnects and the MQTT round trip measured
+    by the clock sync. Times are in ms.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.next_report = time.monotonic() + interval
+        self.last_tick = None
+        self.mem_last = None
+        self.extra = None  # extra() -> dict merged into every report
+        self.reset()
+
+    def reset(self):
+        self.loops = 0
+        self.loop_total = 0
+        self.loop_max = 0
+        self.mqtt_calls = 0
+        self.mqtt_total = 0
+        self.mqtt_max = 0
+        self.gc_runs = 0
+        self.mem_min = None
+
+    def tick(self, now_ns):
+        """Called at the start of every update()."""
+        if self.last_tick is not None:
+            gap = now_ns - self.last_tick
+            self.loops += 1
+            self.loop_total += gap
+            if gap > self.loop_max:
+                self.loop_max = gap
+        self.last_tick = now_ns
+        free = gc.mem_free()
+        if self.mem_last is not None and free > self.mem_last:
+            self.gc_runs += 1
+        self.mem_last = free
+        if self.mem_min is None or free < self.mem_min:
+            self.mem_min = free
+
+    def mqtt(self, ns):
+        self.mqtt_calls += 1
+        self.mqtt_total += ns
+        if ns > self.mqtt_max:
+            self.mqtt_max = ns
+
+    def due(self, now):
+        if now < self.next_report:
+            return False
+        self.next_report = now + self.interval
+        return True
+
+    def report(self, device):
+        """The diagnostics payload, starts a new measurement window."""
+        try:
+            rssi = wifi.radio.ap_info.rssi if wifi.radio.ap_info else None
+        except Exception:
+            rssi = None
+        data = {
+            "up": int(time.monotonic()),
+            "loop": round(self.loop_total / max(self.loops, 1) / 1000000, 1),
+            "loop_max": round(self.loop_max / 1000000, 1),
+            "mqtt": round(self.mqtt_total / max(self.mqtt_calls, 1) / 1000000, 1),
+            "mqtt_max": round(self.mqtt_max / 1000000, 1),
+            "mem": gc.mem_free(),
+            "mem_min": self.mem_min,
+            "gc": self.gc_runs,
+            "rssi": rssi,
+            "rc": device.reconnects,
+            "rtt": device.clock.last_delay,
+        }
+        if self.extra:
+            data.update(self.extra())
+        self.reset()
+        return data
+
+
+class TelemetryEncoder:
+    """
+    Telemetry with a fixed set of fields, written in place into one preallocated
+    MQTT PUBLISH packet. The topic, the packet header layout and every constant
+    part of the JSON are prepared once, values are formatted digit by digit, so
+    sending does not build dicts, strings or a JSON document:
+
+        telemetry = device.telemetry_encoder(("temp", "humi", "relay1"))
+        telemetry.set("temp", 21.5)
+        telemetry.send()
+
+    Without `fields` the device's manifest fields are used and the values are
+    sent as a compact array in field id order ("v": [...]) with the manifest
+    version ("mv"), the hub maps them back to keys with the retained manifest.
+
+    Values can be int, float (written with DECIMALS places), bool, None or
+    a string (encoded once and cached, meant for states like "on"/"off").
+
+    With an iot_buffer.TelemetryBuffer attached, frames that can't be sent
+    are kept and replayed later instead of being dropped.
+    """
+
+    DECIMALS = 2
+
+    def __init__(self, device, fields=None, size=256):
+        self.device = device
+        self.compact = compact = fields is None
+        self.buffer = None  # set by iot_buffer.TelemetryBuffer
+        if compact:
+            fields = [field["key"] for field in device.fields]
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.values = [None] * len(self.fields)
+        self.strings = {}
+
+        topic = f"devices/{device.id}/telemetry".encode()
+        if 2 + len(topic) + size >= 16384:
+            raise ValueError("Telemetry encoder size too large")
+        # [0:3] fixed header (type + 1-2 length bytes, right-aligned), topic, payload
+        self.buf = bytearray(3 + 2 + len(topic) + size)
+        self.view = memoryview(self.buf)
+        self.buf[3] = len(topic) >> 8
+        self.buf[4] = len(topic) & 0xFF
+        self.buf[5:5 + len(topic)] = topic
+        self.start = 5 + len(topic)
+
+        self.head = b'{"ts":'
+        self.sync = (b',"sync":false,"seq":', b',"sync":true,"seq":')
+        if compact:
+            self.boot = f',"boot":{device.boot_id},"mv":{device.manifest_version()},"v":['.encode()
+            self.keys = tuple(b"," if i else b"" for i in range(len(self.fields)))
+            self.close = 93  # ]
+        else:
+            self.boot = f',"boot":{device.boot_id},"data":{{'.encode()
+            self.keys = tuple(f'{"," if i else ""}"{name}":'.encode() for i, name in enumerate(self.fields))
+            self.close = 125  # }
+        self.scale = 10 ** self.DECIMALS
+        self.sent = 0
+
+    def set(self, name, value):
+        self.values[self.index[name]] = value
+
+    # ---------------- Formatting ----------------
+    def _copy(self, pos, data):
+        buf = self.buf
+        for byte in data:
+            buf[pos] = byte
+            pos += 1
+        return pos
+
+    def _digits(self, pos, n, width=0):
+        """Writes a non-negative int, zero-padded to `width`."""
+        end = pos
+        m = n
+        while m or end == pos or end - pos < width:
+            m //= 10
+            end += 1
+        i = end
+        while i > pos:
+            i -= 1
+            self.buf[i] = 48 + n % 10
+            n //= 10
+        return end
+
+    def _number(self, pos, value):
+        if value is None or value != value:  # None or NaN
+            return self._copy(pos, b"null")
+        if value is True or value is False:
+            return self._copy(pos, b"true" if value else b"false")
+        if isinstance(value, str):
+            data = self.strings.get(value)
+            if data is None:
+                data = self.strings[value] = json.dumps(value).encode()
+            return self._copy(pos, data)
+        if isinstance(value, float):
+            value = int(value * self.scale + (0.5 if value >= 0 else -0.5))
+            if value < 0:
+                self.buf[pos] = 45  # -
+                pos += 1
+                value = -value
+            pos = self._digits(pos, value // self.scale)
+            self.buf[pos] = 46  # .
+            return self._digits(pos + 1, value % self.scale, self.DECIMALS)
+        if value < 0:
+            self.buf[pos] = 45
+            pos += 1
+            value = -value
+        return self._digits(pos, value)
+
+    def encode(self):
+        """Writes the payload, returns its end offset in `buf`."""
+        device = self.device
+        ts, synced = device.timestamp()
+        pos = self._copy(self.start, self.head)
+        # Epoch milliseconds don't fit a small int, write them in two halves
+        high, low = divmod(ts, 1000000)
+        if high:
+            pos = self._digits(pos, high)
+            pos = self._digits(pos, low, 6)
+        else:
+            pos = self._digits(pos, low)
+        pos = self._copy(pos, self.sync[synced])
+        pos = self._digits(pos, device.seq)
+        pos = self._copy(pos, self.boot)
+        keys = self.keys
+        values = self.values
+        for i in range(len(keys)):
+            pos = self._copy(pos, keys[i])
+            pos = self._number(pos, values[i])
+        self.buf[pos] = self.close
+        self.buf[pos + 1] = 125  # }
+        return pos + 2
+
+    def payload(self):
+        """The last encoded JSON (allocates, for debugging)."""
+        return bytes(self.view[self.start:self.encode()])
+
+    # ---------------- Sending ----------------
+    def send(self):
+        """Publishes one frame (QoS 0) straight from the buffer. False while disconnected (or buffered)."""
+        device = self.device
+        buffer = self.buffer
+        if device.state != "connected" or (buffer and buffer.pending()):
+            if buffer:
+                buffer.store()  # behind the backlog, keeps the hub's sequence in order
+            return False
+        try:
+            end = self.encode()
+        except IndexError:
+            raise ValueError("Telemetry does not fit the encoder buffer, raise `size`")
+
+        remaining = end - 3
+        buf = self.buf
+        if remaining < 128:
+            first = 1
+            buf[2] = remaining
+        else:
+            first = 0
+            buf[1] = (remaining & 0x7F) | 0x80
+            buf[2] = remaining >> 7
+        buf[first] = 0x30  # PUBLISH, QoS 0, no retain
+
+        client = device.client
+        try:
+            client._send_bytes(self.view[first:end])
+        except (OSError, MQTT.MMQTTException) as e:
+            device._lost(e)
+            if buffer:
+                # A partly written packet never reaches subscribers, so the frame is
+                # kept with the same seq; should the broker have taken it after all,
+                # the hub drops the replayed copy as a duplicate
+                buffer.store()
+            return False
+        client._last_msg_sent_timestamp = ticks_ms()
+        device.seq += 1
+        self.sent += 1
+        return True
+
 
 class IoTDevice:
-    def __init__(self, device_id, broker, pool, port=1883):
+    """
+    MQTT device client. The connection is kept by a small state machine that
+    update() advances without ever sleeping:
+
+        connected -> (loop or publish fails) -> backoff -> (retry time reached)
+        -> re-associate Wi-Fi if needed -> one connect attempt -> connected or backoff
+
+    Retry delays come from the MQTT client's own exponential backoff with jitter.
+    """
+
+    MAX_OUTAGES = 10  # durations of the last outages kept for diagnostics
+
+    def __init__(self, device_id, broker, pool, port=1883, wifi_ssid=None, wifi_password=None, wifi_timeout=5,
+                 socket_timeout=1, loop_timeout=1, diag_interval=60):
         self.id = device_id
+        # update() waits up to loop_timeout for messages (at least socket_timeout).
+        # Short timeouts keep update() from holding up other tasks, see iot_runtime.
         self.client = MQTT.MQTT(
             broker=broker, 
             port=port, 
             socket_pool=pool,
-            connect_retries=3,  # initial connect retries
+            connect_retries=1,  # one attempt per call, the backoff is done by update()
+            socket_timeout=socket_timeout,
         )
+        self.loop_timeout = max(loop_timeout, socket_timeout)
+        self.wifi_ssid = wifi_ssid or os.getenv("WIFI_SSID")
+        self.wifi_password = wifi_password or os.getenv("WIFI_PASSWORD")
+        self.wifi_timeout = wifi_timeout
+
+        # Connection state machine
+        self.state = "disconnected"  # "connected", "backoff" or "disconnected"
+        self.next_attempt = 0
+        self.outage_start = None
+        self.reconnects = 0
+        self.outages = []  # seconds, most recent last
+        self.subscriptions = set()  # restored on every (re)connect
+        self.on_connection_state = None  # on_connection_state(state)
 
         self.cmd_topic = f"devices/{device_id}/commands"
+        self.ack_topic = f"devices/{device_id}/ack"
+        self.status_topic = f"devices/{device_id}/status"
+        self.time_topic = f"devices/{device_id}/time"
+        self.time_reply_topic = f"devices/{device_id}/time/reply"
+        self.manifest_topic = f"devices/{device_id}/manifest"
+        self.diag_topic = f"devices/{device_id}/diag"
+        self.fields = []  # capability manifest, index = field id
+        self._manifest_version = None
         self.on_command_received = None
+        self.on_scene_received = None
+        self.on_scene_message = None  # on_scene_message(data) to apply it later with apply_scene() (iot_runtime)
         self.on_telemetry_received = None
+        self.peer_manifests = {}  # sender id -> (manifest version, field keys) for compact peer telemetry
+        self.undecoded = 0  # compact peer frames dropped for lack of a matching manifest
+
+        # Telemetry sequence number, the boot id tells the hub we restarted
+        self.seq = 0
+        self.boot_id = random.randint(0, 0xFFFFFF)
+        self.clock = ClockSync()
+        self.diag = Diagnostics(diag_interval)
 
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
 
+        # Presence: the broker publishes "offline" for us if we vanish,
+        # and we publish a retained "online" on every connect
+        self.client.will_set(self.status_topic, json.dumps({"online": False}), retain=True)
+
     # ---------------- Internal Callbacks ----------------
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"SDK: Connected! Subscribing to {self.cmd_topic}")
             client.subscribe(self.cmd_topic)
+            client.subscribe(self.time_reply_topic)
+            for topic in self.subscriptions:
+                client.subscribe(topic)
+            if self.fields:
+                client.publish(self.manifest_topic, json.dumps(self.manifest()), retain=True)
+            client.publish(self.status_topic, json.dumps({"online": True}), retain=True)
 
     def _on_message(self, client, topic, payload):
         try:
+            received = local_ms()
             data = json.loads(payload)
-            if "commands" in topic and self.on_command_received:
+            if topic == self.time_reply_topic:
+                self.clock.on_reply(data, received)
+            elif "commands" in topic and isinstance(data.get("commands"), dict):
+                if self.on_scene_message:
+                    self.on_scene_message(data)
+                else:
+                    self.apply_scene(data)
+            elif "commands" in topic and self.on_command_received:
                 self.on_command_received(data.get("command"), data.get("value"))
+            elif topic.endswith("/manifest"):
+                fields = data.get("fields") or ()
+                self.peer_manifests[topic.split("/")[1]] = (data.get("version"), [f["key"] for f in fields])
             elif "telemetry" in topic and self.on_telemetry_received:
                 sender_id = topic.split("/")[1]
-                self.on_telemetry_received(sender_id, data.get("data"), data.get("ts"))
+                # Replayed frames (iot_buffer) come as a batch, oldest first
+                for frame in data["batch"] if "batch" in data else (data,):
+                    values = frame.get("data")
+                    if values is None and "v" in frame:
+                        values = self._decode(sender_id, frame.get("mv", data.get("mv")), frame["v"])
+                        if values is None:
+                            continue
+                    self.on_telemetry_received(sender_id, values, frame.get("ts"))
         except Exception as e:
             print(f"SDK JSON Error: {e}")
 
+    def _decode(self, sender_id, version, values):
+        """Compact "v" values of a peer as {key: value}, None without its (current) manifest."""
+        version_keys = self.peer_manifests.get(sender_id)
+        if version_keys is None or version_keys[0] != version:
+            self.undecoded += 1
+            return None
+        return dict(zip(version_keys[1], values))
+
+    def apply_scene(self, data):
+        """Applies a {command: value} map in one go and acknowledges it once, with the error if it failed."""
+        commands = data["commands"]
+        ack = {"scene": data.get("scene"), "count": len(commands)}
+        try:
+            if self.on_scene_received:
+                self.on_scene_received(commands)
+            elif self.on_command_received:
+                for command, value in commands.items():
+                    self.on_command_received(command, value)
+        except Exception as e:
+            print(f"SDK: scene {data.get('scene')} failed: {e}")
+            ack["error"] = str(e)
+        self._publish(self.ack_topic, json.dumps(ack))
+
+    # ---------------- Connection state machine ----------------
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        print(f"SDK: Connection {state}")
+        if self.on_connection_state:
+            self.on_connection_state(state)
+
+    def _attempt(self):
+        """One connection attempt, Wi-Fi first if it dropped. Returns True when connected."""
+        now = time.monotonic()
+        try:
+            if not wifi.radio.connected:
+                print("SDK: Re-associating WiFi...")
+                wifi.radio.connect(self.wifi_ssid, self.wifi_password, timeout=self.wifi_timeout)
+            # We already waited out the backoff, don't let the client sleep it again
+            attempt = self.client._reconnect_attempt
+            self.client._reconnect_attempt = 0
+            try:
+                self.client.connect()
+            finally:
+                if not self.client.is_connected():
+                    self.client._reconnect_attempt = attempt
+        except Exception as e:
+            self._schedule_retry(now, e)
+            return False
+
+        if self.outage_start is not None:
+            outage = now - self.outage_start
+            self.reconnects += 1
+            self.outages.append(outage)
+            if len(self.outages) > self.MAX_OUTAGES:
+                self.outages.pop(0)
+            print(f"SDK: Reconnected after {outage:.1f}s outage")
+        self.outage_start = None
+        self._set_state("connected")
+        return True
+
+    def _schedule_retry(self, now, error):
+        if self.outage_start is None:
+            self.outage_start = now  # first connect failed
+        self.client._recompute_reconnect_backoff()
+        delay = self.client._reconnect_timeout
+        self.next_attempt = now + delay
+        print(f"SDK: Connect failed ({error}), retry in {delay:.1f}s")
+        self._set_state("backoff")
+
+    def _lost(self, error):
+        """The connection broke: drop the socket and start the outage clock."""
+        print("SDK: MQTT lost:", error)
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.outage_start = time.monotonic()
+        self.next_attempt = self.outage_start  # first retry right away
+        self._set_state("backoff")
+
+    def _publish(self, topic, payload, retain=False):
+        """Publishes if connected, returns False (and starts reconnecting) otherwise."""
+        if self.state != "connected":
+            return False
+        try:
+            self.client.publish(topic, payload, retain=retain)
+            return True
+        except (OSError, MQTT.MMQTTException) as e:
+            self._lost(e)
+            return False
+
+    def outage_stats(self):
+        """Reconnect count, last/longest outage and the current one (seconds)."""
+        current = time.monotonic() - self.outage_start if self.outage_start is not None else 0
+        return {
+            "reconnects": self.reconnects,
+            "last": self.outages[-1] if self.outages else 0,
+            "longest": max(self.outages) if self.outages else 0,
+            "current": current,
+        }
+
     # ---------------- Public Methods ----------------
     def connect(self):
-        """Connect to the MQTT broker"""
-        self.client.connect()
+        """First connection attempt, never raises: on failure update() keeps retrying."""
+        self._attempt()
+        return self.is_connected()
 
     def update(self):
-        """Process MQTT messages"""
-        self.client.loop(timeout=1)
+        """Process MQTT messages, or move the reconnect along. Never blocks on an outage."""
+        start = time.monotonic_ns()
+        self.diag.tick(start)
+        if self.state != "connected":
+            if time.monotonic() >= self.next_attempt:
+                self._attempt()
+            return
+
+        try:
+            self.client.loop(timeout=self.loop_timeout)
+        except (OSError, MQTT.MMQTTException) as e:
+            self._lost(e)
+            return
+        self.diag.mqtt(time.monotonic_ns() - start)
+
+        now = local_ms()
+        if self.clock.due(now):
+            self._publish(self.time_topic, json.dumps(self.clock.request(now)))
+        if self.diag.due(time.monotonic()):
+            self._publish(self.diag_topic, json.dumps(self.diag.report(self)))
+
+    def timestamp(self):
+        """(ms, synced): hub epoch milliseconds once synchronised, milliseconds since boot before."""
+        now = local_ms()
+        if self.clock.synced():
+            return self.clock.to_hub_time(now), True
+        return now, False
 
     def send_telemetry(self, sensor_data):
         topic = f"devices/{self.id}/telemetry"
-        payload = {"ts": int(time.monotonic()), "data": sensor_data}
-        self.client.publish(topic, json.dumps(payload))
+        ts, synced = self.timestamp()
+        payload = {"ts": ts, "sync": synced, "seq": self.seq, "boot": self.boot_id, "data": sensor_data}
+        self.seq += 1
+        return self._publish(topic, json.dumps(payload))
+
+    def telemetry_encoder(self, fields=None, size=256):
+        """Allocation-free alternative to send_telemetry(), compact when `fields` is None."""
+        return TelemetryEncoder(self, fields, size)
+
+    # ---------------- Capability manifest ----------------
+    def describe(self, key, kind="sensor", unit="", type="float", min=None, max=None, name=None):
+        """
+        Adds a sensor (kind "sensor") or an actuator ("relay", "dimmer") to the
+        retained manifest the hub builds its cards from. Returns the field id.
+        Describe everything before connect().
+        """
+        field = {"id": len(self.fields), "key": key, "kind": kind, "type": type}
+        if name:
+            field["name"] = name
+        if unit:
+            field["unit"] = unit
+        if min is not None:
+            field["min"] = min
+        if max is not None:
+            field["max"] = max
+        self.fields.append(field)
+        self._manifest_version = None
+        return field["id"]
+
+    def manifest_version(self):
+        """Small checksum of the fields, telemetry carries it so stale manifests are detected."""
+        if self._manifest_version is None:
+            h = 0
+            for byte in json.dumps(self.fields).encode():
+                h = (h * 31 + byte) & 0xFFFFFF
+            self._manifest_version = h
+        return self._manifest_version
+
+    def manifest(self):
+        return {"version": self.manifest_version(), "fields": self.fields}
 
     def subscribe_telemetry(self, target_id="+"):
-        self.client.subscribe(f"devices/{target_id}/telemetry")
+        """Peer telemetry, with its retained manifest to decode compact frames."""
+        for topic in (f"devices/{target_id}/telemetry", f"devices/{target_id}/manifest"):
+            self.subscriptions.add(topic)
+            if self.state == "connected":
+                self.client.subscribe(topic)
 
     def send_command(self, target_id, command, value):
         topic = f"devices/{target_id}/commands"
         payload = {"command": command, "value": value}
-        self.client.publish(topic, json.dumps(payload))
+        return self._publish(topic, json.dumps(payload))
 
     def is_connected(self):
-        return self.client.is_connected()
+        return self.state == "connected" and self.client.is_connected()
 
-    # ---------------- New Method: Reconnect ----------------
-    def reconnect(self, retry_delay=5):
-        """
-        Attempt to reconnect until successful.
-        Blocks until the connection is restored.
-        """
-        while True:
-            try:
-                print("SDK: Attempting MQTT reconnect...")
-                self.client.connect()
-                print("SDK: MQTT reconnected!")
-                return  # exit loop when successful
-            except Exception as e:
-                print("SDK: Reconnect failed:", e)
-                time.sleep(retry_delay)
\ No newline at end of file
+    def reconnect(self):
+        """Drops the connection and reconnects from update(). Does not block."""
+        if self.state == "connected":
+            self._lost("reconnect requested")
+        self.next_attempt = time.monotonic()
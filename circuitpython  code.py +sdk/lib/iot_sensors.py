@@ -0,0 +1,252 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+# iot_sensors.py
+# -------------------------
+# Non-blocking sensor drivers and the registry that polls them.
+# Every driver follows the same protocol:
+#     start()   begins a measurement, returns the seconds until it can be ready
+#     ready()   True once the measurement can be read
+#     read()    returns {key: value}, raises on a bad measurement
+#     health()  counters for diagnostics
+# Failed measurements are retried with backoff, and the last good reading stays
+# available with its age and quality through registry.reading(key).
+# Usage: sensors = SensorRegistry()
+#        sensors.add(DHTDriver(board.GP3), interval=2)
+#        sensors.on_reading = sampler.push
+#        sensors.poll()                        # often (main loop or a task)
+
+import time
+from array import array
+
+
+class SensorDriver:
+    """Base driver: counts successes and failures, subclasses implement read() (and start/ready if slow)."""
+
+    min_interval = 0  # shortest time between two measurements (datasheet)
+    max_backoff = 60  # longest retry delay after repeated failures
+
+    def __init__(self, name, keys):
+        self.name = name
+        self.keys = tuple(keys)
+        self.reads = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error = None
+        self.last_ok = None
+        self.values = {}  # last good reading
+
+    def start(self):
+        return 0
+
+    def ready(self):
+        return True
+
+    def read(self):
+        raise NotImplementedError
+
+    def succeeded(self, values):
+        self.reads += 1
+        self.consecutive_errors = 0
+        self.last_ok = time.monotonic()
+        self.values = values
+
+    def failed(self, error):
+        self.errors += 1
+        self.consecutive_errors += 1
+        self.last_error = str(error)
+
+    def next_delay(self, interval):
+        """Seconds until the next measurement: `interval`, or a growing retry delay after failures."""
+        interval = max(interval, self.min_interval)
+        if not self.consecutive_errors:
+            return interval
+        # First retry soon, then back off so a missing sensor costs little
+        retry = max(self.min_interval, 1) * 2 ** (self.consecutive_errors - 1)
+        return min(retry, self.max_backoff)
+
+    def quality(self):
+        """"ok" when the last measurement worked, "stale" when the kept reading is older, None without one."""
+        if self.last_ok is None:
+            return None
+        return "stale" if self.consecutive_errors else "ok"
+
+    def age(self):
+        return time.monotonic() - self.last_ok if self.last_ok is not None else None
+
+    def health(self):
+        return {
+            "reads": self.reads, "errors": self.errors, "consecutive": self.consecutive_errors,
+            "last_error": self.last_error, "last_ok_age": self.age(), "quality": self.quality(),
+        }
+
+
+class FunctionDriver(SensorDriver):
+    """Wraps a quick function returning one value (or a dict of values)."""
+
+    def __init__(self, key, func, name=None):
+        super().__init__(name or key, (key,))
+        self.func = func
+
+    def read(self):
+        value = self.func()
+        return value if isinstance(value, dict) else {self.keys[0]: value}
+
+
+class AnalogDriver(SensorDriver):
+    """analogio.AnalogIn, scaled with `scale(raw 0-65535)` (default: volts)."""
+
+    def __init__(self, pin, key, scale=None, name=None, samples=4):
+        import analogio
+
+        super().__init__(name or key, (key,))
+        self.adc = analogio.AnalogIn(pin)
+        self.scale = scale
+        self.samples = samples
+
+    def read(self):
+        total = 0
+        for _ in range(self.samples):
+            total += self.adc.value
+        raw = total // self.samples
+        if self.scale:
+            return {self.keys[0]: self.scale(raw)}
+        return {self.keys[0]: raw * self.adc.reference_voltage / 65535}
+
+
+class DHTDriver(SensorDriver):
+    """
+    DHT11/DHT22 through the library's PulseIn, without its blocking 250 ms wait:
+    start() triggers the sensor, read() decodes the captured pulses once the
+    capture window has passed. A bad capture is just retried later with the
+    same PulseIn and pulse buffer, nothing is re-created.
+    """
+
+    CAPTURE = 0.25  # seconds the sensor needs to send its 40 bits
+    min_interval = 2  # datasheet: one measurement every 2 s at most
+
+    def __init__(self, pin, dht22=False, keys=("temp", "humi"), name=None):
+        import adafruit_dht
+
+        super().__init__(name or ("dht22" if dht22 else "dht11"), keys)
+        self.dht = adafruit_dht.DHT22(pin) if dht22 else adafruit_dht.DHT11(pin)
+        if not self.dht._use_pulseio:
+            raise ValueError("DHTDriver needs pulseio")
+        self.dht11 = not dht22
+        self.started = None
+        self.pulses = array("H", [0] * self.dht._max_pulses)
+
+    def start(self):
+        pulse_in = self.dht.pulse_in
+        pulse_in.clear()
+        try:
+            pulse_in.resume(self.dht._trig_wait)
+        except Exception:
+            pulse_in.pause()
+            raise
+        self.started = time.monotonic()
+        return self.CAPTURE
+
+    def ready(self):
+        return self.started is not None and time.monotonic() - self.started >= self.CAPTURE
+
+    def read(self):
+        pulse_in = self.dht.pulse_in
+        pulse_in.pause()
+        self.started = None
+        pulses = self.pulses
+        count = 0
+        while pulse_in and count < len(pulses):
+            pulses[count] = pulse_in.popleft()
+            count += 1
+        temperature, humidity = self.decode(pulses, count)
+        return {self.keys[0]: temperature, self.keys[1]: humidity}
+
+    def decode(self, pulses, count):
+        """Same checks as adafruit_dht.measure(), raises RuntimeError on a bad capture."""
+        if count < 10:
+            raise RuntimeError("DHT sensor not found, check wiring")
+        if count < 80:
+            raise RuntimeError("A full buffer was not returned")
+        data = [self.dht._pulses_to_binary(pulses, i, i + 16) for i in range(0, 80, 16)]
+        if (data[0] + data[1] + data[2] + data[3]) & 0xFF != data[4]:
+            raise RuntimeError("Checksum did not validate")
+
+        if self.dht11:
+            humidity = data[0]
+            temperature = data[2] + (data[3] & 0x0F) / 10
+        else:
+            humidity = ((data[0] << 8) | data[1]) / 10
+            temperature = (((data[2] & 0x7F) << 8) | data[3]) / 10
+            if data[2] & 0x80:
+                temperature = -temperature
+        if not 0 <= humidity <= 100:
+            raise RuntimeError("Received unplausible data")
+        return temperature, humidity
+
+    def deinit(self):
+        self.dht.exit()
+
+
+class SensorRegistry:
+    """
+    Drives every sensor through start -> ready -> read on its own interval.
+    poll() never waits: a sensor that is measuring is simply checked again on
+    the next call. Fresh readings go to `on_reading(key, value)`, failed ones
+    are retried with the driver's backoff.
+    """
+
+    def __init__(self):
+        self.entries = []  # [driver, interval, next_start, ready_at or None, started]
+        self.sources = {}  # key -> driver
+        self.on_reading = None
+
+    def add(self, driver, interval=2, delay=0):
+        """Measures `driver` every `interval` seconds, the first time after `delay` (sensor warm-up)."""
+        self.entries.append([driver, interval, time.monotonic() + delay, None, 0])
+        for key in driver.keys:
+            self.sources[key] = driver
+        return driver
+
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        for entry in self.entries:
+            driver, interval, next_start, ready_at, started = entry
+            if ready_at is None:
+                if now < next_start:
+                    continue
+                started = entry[4] = now
+                try:
+                    ready_at = entry[3] = now + driver.start()
+                except Exception as e:
+                    driver.failed(e)
+                    print(f"Sensors: {driver.name} start failed: {e}")
+                    entry[2] = now + driver.next_delay(interval)
+                    continue
+            # Quick sensors (start() returns 0) are read in the same call
+            if now >= ready_at and driver.ready():
+                entry[3] = None
+                self._read(driver)
+                # Planned from the start so the capture time doesn't add up
+                entry[2] = started + driver.next_delay(interval)
+
+    def _read(self, driver):
+        try:
+            values = driver.read()
+        except Exception as e:
+            driver.failed(e)
+            print(f"Sensors: {driver.name} read failed: {e}")
+            return
+        driver.succeeded(values)
+        if self.on_reading:
+            for key, value in values.items():
+                self.on_reading(key, value)
+
+    def reading(self, key):
+        """(value, age in seconds, quality) of the last good reading of `key`, quality "ok"/"stale"/None."""
+        driver = self.sources.get(key)
+        if driver is None or driver.last_ok is None:
+            return None, None, None
+        return driver.values.get(key), driver.age(), driver.quality()
+
+    def health(self):
+        return {entry[0].name: entry[0].health() for entry in self.entries}
@@ -1,13 +1,121 @@
 # led_patterns.py
 # -------------------------
 # Define LED error patterns for Raspberry Pi Pico / CircuitPython
-# Usage: import led_patterns
+# Non-blocking: leds = led_paterns.LedEngine(devled)
+#               leds.show("blink")                          # until cleared
+#               leds.show("sos", priority=2, repeat=3)      # on top, 3 times
+#               leds.tick()                                 # from the main loop or a task
+# Fatal errors (never return):
 #        led_patterns.blink(devled)
 #        led_patterns.pattern_fast(devled)
 #        led_patterns.pattern_sos(devled)
 
 import time
 
+# Timing tables: alternating ON/OFF durations in ms, starting with ON
+PATTERNS = {
+    "solid": (1000, 0),
+    "blink": (500, 500),
+    "fast": (100, 100),
+    "slow": (1000, 1000),
+    "heartbeat": (80, 120, 80, 720),
+    "sos": (200, 200, 200, 200, 200, 400,
+            600, 200, 600, 200, 600, 400,
+            200, 200, 200, 200, 200, 1200),
+}
+
+IDLE_MS = 100  # tick interval when no pattern is active
+
+
+def check(table):
+    """Returns `table` as a tuple, ValueError if it could never advance (tick() would loop forever)."""
+    table = tuple(table)
+    if not table or any(ms < 0 for ms in table) or sum(table) <= 0:
+        raise ValueError(f"LED pattern needs non-negative durations with a positive total: {table}")
+    return table
+
+
+for _table in PATTERNS.values():
+    check(_table)
+
+
+class LedEngine:
+    """
+    Plays timing tables on a LED without blocking. Patterns are queued with a
+    priority: the highest one plays (the oldest first among equals), a pattern
+    with `repeat` is dropped after that many cycles and the next one resumes.
+    """
+
+    def __init__(self, led):
+        self.led = led
+        self.patterns = []  # [priority, order, name, table, repeats left (0 = forever)]
+        self.order = 0
+        self.current = None
+        self.step = 0
+        self.until = 0
+        led.value = 0
+
+    def show(self, pattern, priority=0, repeat=0, name=None):
+        """Queues a pattern (name from PATTERNS or a timing table). Same name replaces."""
+        table = check(PATTERNS[pattern] if isinstance(pattern, str) else pattern)
+        name = name or (pattern if isinstance(pattern, str) else "custom")
+        self.clear(name)
+        self.patterns.append([priority, self.order, name, table, repeat])
+        self.order += 1
+
+    def clear(self, name=None, priority=None):
+        """Removes patterns by name and/or priority, everything without arguments."""
+        self.patterns = [
+            p for p in self.patterns
+            if not ((name is None or p[2] == name) and (priority is None or p[0] == priority))
+        ]
+
+    def playing(self):
+        return self.current[2] if self.current else None
+
+    def _top(self):
+        top = None
+        for p in self.patterns:
+            if top is None or p[0] > top[0] or (p[0] == top[0] and p[1] < top[1]):
+                top = p
+        return top
+
+    def tick(self, now=None):
+        """Updates the LED, returns the ms until the next change."""
+        now = time.monotonic_ns() // 1000000 if now is None else now
+        top = self._top()
+        if top is not self.current:
+            self.current = top
+            self.step = 0
+            self.until = now
+        if top is None:
+            self.led.value = 0
+            return IDLE_MS
+
+        table = top[3]
+        if now - self.until > 1000:
+            self.until = now  # we were not ticked for a while, don't replay the backlog
+        while now >= self.until:
+            if self.step == len(table):
+                self.step = 0
+                if top[4]:
+                    top[4] -= 1
+                    if top[4] == 0:
+                        self.patterns.remove(top)
+                        return self.tick(now)
+            self.led.value = 1 if self.step % 2 == 0 else 0
+            self.until += table[self.step]
+            self.step += 1
+        return self.until - now
+
+
+def _forever(devled, table):
+    while True:
+        for step, ms in enumerate(table):
+            devled.value = 1 if step % 2 == 0 else 0
+            time.sleep(ms / 1000)
+
+
 def blink(devled, delay=0.5):
     """Simple blink: ON -> OFF repeatedly"""
     while True:
@@ -18,40 +126,12 @@ def blink(devled, delay=0.5):
 
 def fast(devled):
     """Fast blink: quick flashes"""
-    while True:
-        devled.value = 1
-        time.sleep(0.1)
-        devled.value = 0
-        time.sleep(0.1)
+    _forever(devled, PATTERNS["fast"])
 
 def slow(devled):
     """Slow blink: long flashes"""
-    while True:
-        devled.value = 1
-        time.sleep(1)
-        devled.value = 0
-        time.sleep(1)
+    _forever(devled, PATTERNS["slow"])
 
 def sos(devled):
     """SOS Morse code pattern: ... --- ..."""
-    def dot():
-        devled.value = 1
-        time.sleep(0.2)
-        devled.value = 0
-        time.sleep(0.2)
-    def dash():
-        devled.value = 1
-        time.sleep(0.6)
-        devled.value = 0
-        time.sleep(0.2)
-    
-    while True:
-        # S: dot dot dot
-        dot(); dot(); dot()
-        time.sleep(0.2)
-        # O: dash dash dash
-        dash(); dash(); dash()
-        time.sleep(0.2)
-        # S: dot dot dot
-        dot(); dot(); dot()
-        time.sleep(1)
\ No newline at end of file
+    _forever(devled, PATTERNS["sos"])
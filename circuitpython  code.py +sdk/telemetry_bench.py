@@ -0,0 +1,142 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+# telemetry_bench.py
+# -------------------------
+# Heap use of one telemetry frame: json.dumps path vs TelemetryEncoder, in the
+# configuration code.py ships: compact encoder (device.telemetry_encoder(), "v"
+# array in manifest order) with the clock synced to the hub (epoch-ms timestamps).
+# Runs offline on the Pico (no Wi-Fi or broker needed), from the REPL:
+#        import telemetry_bench
+#
+# The encoder is not allocation-free. Per frame it still allocates:
+#   - the time.monotonic_ns() result (a long int after the first second of uptime)
+#   - the epoch-ms timestamp (~1.8e12, a long int) and its divmod() tuple
+#   - the memoryview slice handed to the socket
+# i.e. a handful of small objects, against the dict, f-string, JSON document
+# and encoded copies of the json.dumps path. The printed bytes/frame is the
+# number to quote; it depends on the CircuitPython build.
+
+import gc
+import json
+import time
+from iot_sdk import ClockSync, IoTDevice, TelemetryEncoder
+
+FRAMES = 200
+SENSORS = ("temp", "humi")
+RELAYS = ("relay1", "relay2", "relay3", "relay4")
+EPOCH_MS = 1790000000000  # hub clock used for the fake time sync
+
+
+class Sink:
+    """Stands in for the MQTT client: counts the bytes instead of sending them."""
+
+    def __init__(self):
+        self.bytes = 0
+        self._last_msg_sent_timestamp = 0
+
+    def _send_bytes(self, data):
+        self.bytes += len(data)
+
+    def publish(self, topic, msg, retain=False):
+        # What MQTT.publish() allocates before sending: header, encoded topic, payload
+        header = bytearray([0x30])
+        var = bytearray(len(topic.encode("utf-8")).to_bytes(2, "big"))
+        var.extend(topic.encode("utf-8"))
+        msg = msg.encode("utf-8")
+        remaining = len(topic.encode("utf-8")) + len(msg) + 2
+        while remaining > 0x7F:
+            header.append((remaining & 0x7F) | 0x80)
+            remaining >>= 7
+        header.append(remaining)
+        self.bytes += len(header) + len(var) + len(msg)
+
+
+class BenchDevice:
+    """The parts of IoTDevice the encoder uses, with the manifest of code.py and a synced clock."""
+
+    describe = IoTDevice.describe
+    manifest_version = IoTDevice.manifest_version
+    timestamp = IoTDevice.timestamp
+
+    def __init__(self):
+        self.id = "pico_01"
+        self.client = Sink()
+        self.state = "connected"
+        self.seq = 0
+        self.boot_id = 123456
+        self.fields = []
+        self._manifest_version = None
+
+        # One exchange with the hub: synced, with a typical crystal drift
+        self.clock = ClockSync()
+        now = time.monotonic_ns() // 1000000
+        self.clock.request(now)
+        self.clock.on_reply({"t0": now, "t1": EPOCH_MS, "t2": EPOCH_MS}, now)
+        self.clock.skew = 0.00002
+
+        for key in SENSORS:
+            self.describe(key)
+        for name in RELAYS:
+            self.describe(name, kind="relay", type="str")
+        self.describe("dimmer1", kind="dimmer", type="int")
+        for key in SENSORS:
+            for stat in ("min", "max", "last"):
+                self.describe(f"{key}_{stat}", kind="stat")
+            self.describe(f"{key}_n", kind="stat", type="int")
+            self.describe(f"{key}_age", kind="stat", type="int")
+
+
+def values(temp, humi):
+    return {
+        "temp": temp, "temp_min": temp - 0.5, "temp_max": temp + 0.5, "temp_last": temp, "temp_n": 10, "temp_age": 1,
+        "humi": humi, "humi_min": humi - 0.5, "humi_max": humi + 0.5, "humi_last": humi, "humi_n": 10, "humi_age": 1,
+        "relay1": "on", "relay2": "off", "relay3": "off", "relay4": "on", "dimmer1": 40,
+    }
+
+
+def legacy(device, temp, humi):
+    sensor_data = values(temp, humi)
+    topic = f"devices/{device.id}/telemetry"
+    ts, synced = device.timestamp()
+    payload = {"ts": ts, "sync": synced, "seq": device.seq, "boot": device.boot_id, "data": sensor_data}
+    device.seq += 1
+    device.client.publish(topic, json.dumps(payload))
+
+
+def encoder(telemetry, temp, humi):
+    # Same calls as code.py's send_telemetry()
+    for key in SENSORS:
+        value = temp if key == "temp" else humi
+        telemetry.set(key, value)
+        telemetry.set(f"{key}_min", value - 0.5)
+        telemetry.set(f"{key}_max", value + 0.5)
+        telemetry.set(f"{key}_last", value)
+        telemetry.set(f"{key}_n", 10)
+        telemetry.set(f"{key}_age", 1)
+    for name in RELAYS:
+        telemetry.set(name, "on" if name in ("relay1", "relay4") else "off")
+    telemetry.set("dimmer1", 40)
+    telemetry.send()
+
+
+def measure(name, send, arg):
+    send(arg, 21.5, 48)  # warm up (first use caches strings)
+    used = 0
+    elapsed = 0
+    for i in range(FRAMES):
+        # Collect before each frame so a GC never runs inside the measurement
+        gc.collect()
+        free = gc.mem_free()
+        start = time.monotonic_ns()
+        send(arg, 21.5, 48 + i % 10)
+        elapsed += time.monotonic_ns() - start
+        used += free - gc.mem_free()
+    print(f"{name}: {used // FRAMES} bytes allocated/frame, {elapsed // 1000 // FRAMES} us/frame")
+
+
+device = BenchDevice()
+telemetry = TelemetryEncoder(device)  # compact, like device.telemetry_encoder()
+print("compact:", telemetry.compact, "synced:", device.timestamp()[1], "ts:", device.timestamp()[0])
+measure("json.dumps ", legacy, BenchDevice())
+measure("encoder    ", encoder, telemetry)
+print(telemetry.payload())
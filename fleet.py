@@ -0,0 +1,73 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+import time
+
+
+class DeviceState:
+    __slots__ = ("dev_id", "values", "last_seen", "frames")
+
+    def __init__(self, dev_id):
+        self.dev_id = dev_id
+        self.values = {}
+        self.last_seen = None
+        self.frames = 0
+
+
+class FleetState:
+    """
+    Latest values and last-seen time of every device, updated incrementally from
+    telemetry. Devices touched since the last redraw are kept in a dirty set so
+    the overview only rebuilds the tiles that changed.
+    """
+
+    def __init__(self, offline_after=30):
+        self.offline_after = offline_after
+        self.devices = {}
+        self.dirty = set()
+
+    def state(self, dev_id):
+        st = self.devices.get(dev_id)
+        if st is None:
+            st = self.devices[dev_id] = DeviceState(dev_id)
+        return st
+
+    def update(self, dev_id, data, now=None):
+        st = self.state(dev_id)
+        if data:
+            st.values.update(data)
+        st.last_seen = time.time() if now is None else now
+        st.frames += 1
+        self.dirty.add(dev_id)
+
+    def forget(self, dev_id):
+        self.devices.pop(dev_id, None)
+        self.dirty.discard(dev_id)
+
+    def is_online(self, dev_id, now=None):
+        st = self.devices.get(dev_id)
+        if st is None or st.last_seen is None:
+            return False
+        now = time.time() if now is None else now
+        return now - st.last_seen < self.offline_after
+
+    def age(self, dev_id, now=None):
+        """Seconds since the device was last heard from, None if never."""
+        st = self.devices.get(dev_id)
+        if st is None or st.last_seen is None:
+            return None
+        now = time.time() if now is None else now
+        return now - st.last_seen
+
+    def take_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+
+def format_age(seconds):
+    if seconds is None:
+        return "never"
+    if seconds < 60:
+        return f"{int(seconds)}s ago"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m ago"
+    return f"{int(seconds // 3600)}h ago"
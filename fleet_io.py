@@ -0,0 +1,197 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+"""
+Bulk import/export of fleet definitions (devices, relays, dimmers, sensors).
+
+One row per entry, as CSV (with a header line) or JSON lines:
+
+    type,device,name,channel,unit,state,chart,broker
+    device,pico_01,,,,,,
+    device,pico_02,,,,,,10.0.2.5:1883
+    relay,pico_01,Lamp,relay1,,off,,
+    dimmer,pico_01,Strip,dimmer1,,0,,
+    sensor,pico_01,Temperature,temp,°C,,30,
+
+`channel` is the command of relays/dimmers and the JSON key of sensors
+("cmd" and "key" are accepted as well). `broker` ('host[:port]') is only read
+on device rows: empty means the default broker, a missing column leaves the
+device's broker unchanged. Usage:
+
+    python fleet_io.py import site.csv
+    python fleet_io.py export backup.jsonl --db path/to/iotcontrol.db
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from registry import DeviceRegistry
+
+TYPES = ("device", "relay", "dimmer", "sensor")
+FIELDS = ("type", "device", "name", "channel", "unit", "state", "chart", "broker")
+
+
+class FleetFormatError(ValueError):
+    pass
+
+
+def default_db_path():
+    """Same location as the app's user_data_dir (Kivy's rules for an app named 'iotcontrol')."""
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+    return os.path.join(base, "iotcontrol", "iotcontrol.db")
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def decode_lines(f):
+    """
+    Lines of a binary file as text, decoded one by one so a bad byte is reported
+    on its line. A leading BOM (CSV saved by Excel) is dropped.
+    """
+    for number, line in enumerate(f, start=1):
+        try:
+            yield line.decode("utf-8-sig" if number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            raise FleetFormatError(f"line {number}: not UTF-8 text")
+
+
+def read_rows(lines, fmt):
+    """Yields (line_number, raw dict) without loading the whole file."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        rows = iter(reader)
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                raise FleetFormatError(f"line {reader.line_num}: invalid CSV ({e})")
+            yield reader.line_num, row
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise FleetFormatError(f"line {number}: invalid JSON ({e})")
+        if not isinstance(row, dict):
+            raise FleetFormatError(f"line {number}: expected a JSON object")
+        yield number, row
+
+
+def validate(number, raw):
+    """Normalizes one raw row, raises FleetFormatError with the line number on bad input."""
+    def text(key):
+        value = raw.get(key)
+        return "" if value is None else str(value).strip()
+
+    kind = text("type").lower()
+    device = text("device")
+    if kind not in TYPES:
+        raise FleetFormatError(f"line {number}: type must be one of {', '.join(TYPES)}")
+    if not device:
+        raise FleetFormatError(f"line {number}: device is required")
+    if kind == "device":
+        broker = raw.get("broker")
+        if broker is not None:
+            broker = text("broker")
+            host, sep, port = broker.rpartition(":")
+            if sep and (not host or not port.isdigit()):
+                raise FleetFormatError(f"line {number}: broker must be host or host:port")
+        return {"type": kind, "device": device, "broker": broker}
+
+    channel = text("channel") or text("cmd") or text("key")
+    if not channel:
+        raise FleetFormatError(f"line {number}: channel is required for a {kind}")
+    row = {"type": kind, "device": device, "name": text("name") or channel, "channel": channel}
+
+    if kind == "sensor":
+        chart = text("chart") or "0"
+        if not chart.isdigit():
+            raise FleetFormatError(f"line {number}: chart must be a number of minutes")
+        row.update(unit=text("unit"), chart=int(chart))
+    elif kind == "relay":
+        state = text("state").lower() or "off"
+        if state not in ("on", "off"):
+            raise FleetFormatError(f"line {number}: relay state must be on or off")
+        row["state"] = state
+    else:
+        # Whole numbers only, but 50.0 (JSON numbers, spreadsheets) is fine
+        try:
+            level = float(text("state") or "0")
+        except ValueError:
+            level = -1
+        if not level.is_integer() or not 0 <= level <= 100:
+            raise FleetFormatError(f"line {number}: dimmer state must be 0-100")
+        row["state"] = str(int(level))
+    return row
+
+
+def import_file(registry, path, fmt=None):
+    fmt = detect_format(path, fmt)
+    with open(path, "rb") as f:
+        rows = (validate(number, raw) for number, raw in read_rows(decode_lines(f), fmt))
+        return registry.bulk_import(rows)
+
+
+def export_file(registry, path, fmt=None):
+    fmt = detect_format(path, fmt)
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for row in registry.iter_export():
+            if writer:
+                writer.writerow(row)
+            else:
+                # An empty broker is kept on device rows: it means the default broker
+                kept = {k: v for k, v in row.items() if v != "" or (k == "broker" and row["type"] == "device")}
+                f.write(json.dumps(kept) + "\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of IoT Control fleet definitions.")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("file", help="CSV (.csv) or JSON lines file")
+    parser.add_argument("--db", default=default_db_path(), help="registry database (default: the app's)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="override the format guessed from the file name")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    registry = DeviceRegistry(args.db)
+    started = time.perf_counter()
+    try:
+        if args.action == "import":
+            counts = import_file(registry, args.file, args.format)
+            summary = ", ".join(f"{n} {kind}s" for kind, n in counts.items())
+            print(f"Imported {summary} into {args.db}")
+        else:
+            count = export_file(registry, args.file, args.format)
+            print(f"Exported {count} rows to {args.file}")
+    except (FleetFormatError, OSError) as e:
+        print(f"Error: {e} (nothing was imported)" if args.action == "import" else f"Error: {e}")
+        return 1
+    finally:
+        registry.close()
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
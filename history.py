@@ -0,0 +1,119 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+import bisect
+import time
+from collections import deque
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Reduces a list of (x, y) points to `threshold` points while keeping the
+    visual shape of the series (peaks and dips survive, flat runs collapse).
+    """
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]] if threshold == 2 else [points[-1]]
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average point of the next bucket is the third corner of the triangle
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = avg_y = 0.0
+        for x, y in points[avg_start:avg_end]:
+            avg_x += x
+            avg_y += y
+        count = avg_end - avg_start
+        avg_x /= count
+        avg_y /= count
+
+        # Pick the point of the current bucket forming the largest triangle
+        ax, ay = points[a]
+        max_area = -1.0
+        chosen = a
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+
+        sampled.append(points[chosen])
+        a = chosen
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class SensorHistory:
+    """
+    Local (timestamp, value) history for the sensor keys that have a chart.
+    Only tracked (device, key) pairs are recorded, each bounded by its window.
+    """
+
+    def __init__(self, max_points=5000):
+        self.max_points = max_points
+        self.series = {}    # (dev_id, key) -> deque of (ts, value)
+        self.windows = {}   # (dev_id, key) -> seconds kept
+        self.versions = {}  # (dev_id, key) -> bumped on every change
+
+    def track(self, dev_id, key, window):
+        name = (dev_id, key)
+        self.windows[name] = max(window, self.windows.get(name, 0))
+        if name not in self.series:
+            self.series[name] = deque(maxlen=self.max_points)
+            self.versions[name] = 0
+
+    def add(self, dev_id, data, ts=None):
+        if not data:
+            return
+        ts = time.time() if ts is None else ts
+        for key, value in data.items():
+            name = (dev_id, key)
+            buf = self.series.get(name)
+            if buf is None or isinstance(value, bool):
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if buf and ts < buf[-1][0]:
+                # Replayed frame from a device's offline buffer: keep the series in time order
+                if len(buf) == buf.maxlen:
+                    buf.popleft()
+                buf.insert(bisect.bisect(buf, (ts, value)), (ts, value))
+            else:
+                buf.append((ts, value))
+            self._trim(name, buf, ts)
+            self.versions[name] += 1
+
+    def points(self, dev_id, key, window, now=None):
+        """Returns the points of the last `window` seconds, oldest first."""
+        name = (dev_id, key)
+        buf = self.series.get(name)
+        if not buf:
+            return []
+        now = time.time() if now is None else now
+        if self._trim(name, buf, now):
+            self.versions[name] += 1
+        start = now - window
+        if buf[0][0] >= start:
+            return list(buf)
+        return [p for p in buf if p[0] >= start]
+
+    def version(self, dev_id, key):
+        return self.versions.get((dev_id, key), -1)
+
+    def _trim(self, name, buf, now):
+        oldest = now - self.windows[name]
+        trimmed = False
+        while buf and buf[0][0] < oldest:
+            buf.popleft()
+            trimmed = True
+        return trimmed
@@ -1,40 +1,176 @@
 # Copyright (C) 2026 Mohamed Akoum
 #24-4-2026
+import time
+_STARTED = time.perf_counter()  # taken before the heavy Kivy imports on purpose
+
 import json, os, shutil
+from collections import deque
 from kivy.lang import Builder
 from kivy.clock import Clock
+from kivy.graphics import Color, Line
+from kivy.uix.widget import Widget
 from kivymd.app import MDApp
 from kivymd.uix.card import MDCard
-from kivymd.uix.button import MDRaisedButton, MDIconButton, MDFlatButton
-from kivymd.uix.button import MDFlatButton, MDRectangleFlatIconButton
+from kivymd.uix.button import MDRaisedButton, MDIconButton
 from kivymd.uix.label import MDLabel
-from kivymd.uix.dialog import MDDialog
 from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.menu import MDDropdownMenu
-from kivymd.uix.textfield import MDTextField
-from sdk import IoTDevice
-from kivy.uix.screenmanager import ScreenManager, Screen
+from sdk import HubPool, parse_broker
+from registry import DeviceRegistry
+from fleet import FleetState, format_age
+from rules import Rule, RulesEngine
+from scheduler import CATCH_UP_POLICIES, Job, Scheduler
+from history import SensorHistory, lttb
 from kivy.core.window import Window
 
+# Dialog, text field and menu widgets are imported where they are first built,
+# they are not needed to draw the first frame.
+
 try:
     import pyi_splash
 except ImportError:
     pyi_splash = None
 
+SCENE_ACK_TIMEOUT = 5  # seconds a device has to confirm a scene
+
+
+class StartupTimeline:
+    """Milestones of the launch (import, build, first frame, first telemetry), logged on each start."""
+
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+
+    def mark(self, name):
+        if name in self.marks:
+            return
+        self.marks[name] = (time.perf_counter() - self.started) * 1000
+        print(f"Startup: {name} at {self.marks[name]:.1f} ms")
+
+    def summary(self):
+        return ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.marks.items())
+
+
+startup = StartupTimeline(_STARTED)
+startup.mark("import")
+
+
+class TelemetryBatcher:
+    """
+    Lock-free handoff of telemetry from paho's network thread to the Kivy loop.
+    The network thread only appends to a per-device deque (atomic in CPython);
+    the Kivy clock drains every buffer once per frame and merges the frames of
+    each device into a single update. Replayed frames (buffered by the device
+    during an outage) only reach `on_frame`, they never update the cards.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.frames_skipped = 0
+        self.messages_merged = 0
+
+    def put(self, dev_id, data, timestamp, replayed=False):
+        buf = self.buffers.get(dev_id)
+        if buf is None:
+            buf = self.buffers.setdefault(dev_id, deque())
+        buf.append((data, timestamp, replayed))
+
+    def drain(self, on_frame=None):
+        """
+        Returns {dev_id: (merged_data, latest_ts)} for everything received since the last call.
+        `on_frame(dev_id, data, ts)` is called for every raw frame before merging.
+        """
+        merged = {}
+        for dev_id, buf in tuple(self.buffers.items()):
+            count = 0
+            while buf:
+                data, timestamp, replayed = buf.popleft()
+                if on_frame:
+                    on_frame(dev_id, data, timestamp)
+                if replayed:
+                    continue
+                entry = merged.get(dev_id)
+                if entry is None:
+                    entry = merged[dev_id] = [{}, timestamp]
+                if data:
+                    entry[0].update(data)
+                entry[1] = timestamp
+                count += 1
+            if count > 1:
+                self.messages_merged += count - 1
+
+        if not merged:
+            self.frames_skipped += 1
+        return merged
+
+
+class Sparkline(Widget):
+    """
+    Inline trend line of one sensor key. The Line instruction is created once and
+    its points are only recomputed when the history changed or the widget resized,
+    downsampled with LTTB to one point per horizontal pixel.
+    """
+
+    def __init__(self, history, dev_id, data_key, minutes, **kwargs):
+        super().__init__(**kwargs)
+        self.history = history
+        self.dev_id = dev_id
+        self.data_key = data_key
+        self.window = minutes * 60
+        self._drawn_version = None
+        history.track(dev_id, data_key, self.window)
+
+        with self.canvas:
+            Color(0.35, 0.7, 1, 1)
+            self.line = Line(points=[], width=1.2)
+        self.bind(pos=self._resized, size=self._resized)
+
+    def _resized(self, *args):
+        self._drawn_version = None
+        self.refresh()
+
+    def refresh(self):
+        version = self.history.version(self.dev_id, self.data_key)
+        if version == self._drawn_version:
+            return
+        points = self.history.points(self.dev_id, self.data_key, self.window)
+        self._drawn_version = self.history.version(self.dev_id, self.data_key)
+        if len(points) < 2 or self.width < 2:
+            self.line.points = []
+            return
+
+        points = lttb(points, int(self.width))
+        t0, t1 = points[0][0], points[-1][0]
+        lo = min(p[1] for p in points)
+        hi = max(p[1] for p in points)
+        span_t = (t1 - t0) or 1
+        span_v = (hi - lo) or 1
+        x, y, w, h = self.x, self.y, self.width, self.height
+
+        flat = []
+        for ts, value in points:
+            flat.append(x + (ts - t0) / span_t * w)
+            flat.append(y + (value - lo) / span_v * h)
+        self.line.points = flat
+
 
 class SensorCard(MDCard):
-    def __init__(self, name, data_key, unit, on_remove, **kwargs):
+    def __init__(self, name, data_key, unit, on_remove, history=None, dev_id=None, chart_minutes=0, **kwargs):
         super().__init__(**kwargs)
         self.size_hint_y = None
-        self.height = "75dp"
+        self.height = "120dp" if chart_minutes and history else "75dp"
         self.padding = "15dp"
         self.md_bg_color = [0.1, 0.1, 0.2, 1]
         self.radius = [15,]
         self.data_key = data_key
         content = MDBoxLayout(orientation='vertical')
         content.add_widget(MDLabel(text=name, font_style="Caption", theme_text_color="Secondary"))
+        self.unit = unit
         self.val_label = MDLabel(text=f"-- {unit}", font_style="H6", bold=True)
         content.add_widget(self.val_label)
+        self.chart = None
+        if chart_minutes and history:
+            self.chart = Sparkline(history, dev_id, data_key, chart_minutes)
+            content.add_widget(self.chart)
         self.add_widget(content)
         self.add_widget(MDIconButton(icon="close", pos_hint={"center_y": .5}, on_release=lambda x: on_remove(name, data_key)))
 
@@ -65,9 +201,10 @@ class RelayCard(MDCard):
         self.update_visual()
 
     def press_action(self, card_state):
-        self.card_state = card_state
-        self.on_power(self.cmd, card_state)
-        self.update_visual()
+        # The card only switches once the command was actually sent
+        if self.on_power(self.cmd, card_state):
+            self.card_state = card_state
+            self.update_visual()
 
     def update_visual(self):
         if self.card_state == "on":
@@ -76,6 +213,96 @@ class RelayCard(MDCard):
             self.md_bg_color = ("#7a3e3e")
 
 
+class FleetTile(MDCard):
+    """Compact overview tile of one device: online state, a few values and last-seen age."""
+
+    def __init__(self, dev_id, on_open, **kwargs):
+        super().__init__(**kwargs)
+        self.dev_id = dev_id
+        self.size_hint_y = None
+        self.height = "110dp"
+        self.padding = "10dp"
+        self.radius = [15,]
+        self.bind(on_release=lambda x: on_open(dev_id))
+        self._online = None
+
+        content = MDBoxLayout(orientation='vertical')
+        content.add_widget(MDLabel(text=dev_id, bold=True))
+        self.values_label = MDLabel(text="--", font_style="Caption")
+        self.age_label = MDLabel(text="never", font_style="Caption", theme_text_color="Secondary")
+        content.add_widget(self.values_label)
+        content.add_widget(self.age_label)
+        self.add_widget(content)
+        self.set_online(False)
+
+    def set_online(self, online):
+        if online != self._online:
+            self._online = online
+            self.md_bg_color = "#2e5a4a" if online else "#4a2e2e"
+
+    def set_values(self, text):
+        self.values_label.text = text
+
+    def set_age(self, text):
+        if self.age_label.text != text:
+            self.age_label.text = text
+
+
+def to_level(value):
+    """Dimmer level 0-100 from a telemetry or stored value, None if it isn't a number."""
+    try:
+        return min(100, max(0, int(float(value))))
+    except (TypeError, ValueError):
+        return None
+
+
+class DimmerCard(MDCard):
+    """0-100 slider for PWM outputs. Drag positions go through a throttled command stream."""
+
+    def __init__(self, name, cmd, level, on_remove, on_level, **kwargs):
+        from kivymd.uix.slider import MDSlider
+
+        super().__init__(**kwargs)
+        self.size_hint_y = None
+        self.height = "85dp"
+        self.padding = "10dp"
+        self.spacing = "10dp"
+        self.radius = [15,]
+        self.md_bg_color = "#3e5a7a"
+        self.cmd = cmd
+        self.on_level = on_level
+        self._syncing = False
+
+        layout = MDBoxLayout(orientation="horizontal", spacing=10)
+        layout.add_widget(MDLabel(text=name.upper(), bold=True, size_hint_x=0.3))
+        self.slider = MDSlider(min=0, max=100, step=1, value=level, hint=False)
+        self.level_label = MDLabel(text=f"{int(level)}%", size_hint_x=0.15)
+        layout.add_widget(self.slider)
+        layout.add_widget(self.level_label)
+        layout.add_widget(MDIconButton(icon="trash-can", theme_text_color="Error", on_release=lambda x: on_remove(name, cmd)))
+        self.add_widget(layout)
+
+        self.slider.bind(value=self._moved)
+        self.slider.bind(on_touch_up=self._released)
+
+    def _moved(self, slider, value):
+        self.level_label.text = f"{int(value)}%"
+        if not self._syncing:
+            self.on_level(self.cmd, int(value), False)
+
+    def _released(self, slider, touch):
+        if touch.grab_current is slider:
+            self.on_level(self.cmd, int(slider.value), True)
+
+    def set_level(self, level, force=False):
+        # Telemetry never fights the user's finger
+        if self.slider.active and not force:
+            return
+        self._syncing = True
+        self.slider.value = level
+        self._syncing = False
+
+
 import sys
 def resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
@@ -92,22 +319,48 @@ class IoTControlApp(MDApp):
         os.makedirs(self.user_data_dir, exist_ok=True)
         self.config_path = os.path.join(self.user_data_dir, "config.json")
         self.old_config_path = os.path.join(os.getcwd(), "config.json")
+        self.registry = DeviceRegistry(os.path.join(self.user_data_dir, "iotcontrol.db"))
         self.migrate_old_config()
         self.load_data()
         self.device_id = self.device_options[0] if self.device_options else "None"
 
-        # FIX: Use self.id (not mqtt_id) to match sdk.py's attribute name
-        self.hub = IoTDevice(device_id=self.mqtt_id, broker=self.mqtt_broker, port=self.mqtt_port)
+        # One connection per broker, devices of other sites are routed to theirs
+        self.hub = HubPool(device_id=self.mqtt_id, broker=self.mqtt_broker, port=self.mqtt_port)
+        for dev_id, broker in self.registry.device_brokers().items():
+            try:
+                self.hub.set_route(dev_id, *parse_broker(broker))
+            except ValueError as e:
+                print(f"Registry: {dev_id}: {e}")
         self.hub.on_telemetry_received = self.on_telemetry_callback
-        self.reconnect_hub()
-        Clock.schedule_interval(self.check_connection, 2)
+        self.hub.on_replay_received = self.on_replay_callback
+        self.hub.on_manifest_received = lambda dev_id, m: Clock.schedule_once(lambda dt: self.apply_manifest(dev_id, m))
+        self.hub.on_connection_state = lambda state: Clock.schedule_once(lambda dt: self.show_connection(state))
+        self.hub.on_link_quality = lambda rtt, degraded: Clock.schedule_once(lambda dt: self.show_link(rtt, degraded))
+        self.hub.on_ack_received = lambda dev_id, data: Clock.schedule_once(lambda dt: self.on_scene_ack(dev_id, data))
+        self.scene_runs = {}  # scene name -> {"pending", "ok", "failed", "timeout", "offline", "commands"} of its last run
+        self.screen_title = "IoT Control"
+        self.telemetry = TelemetryBatcher()
+        self.history = SensorHistory()
+        self.fleet = FleetState()
+        self.rules = RulesEngine(self.hub.send_command)
+        self.rules.load(self.registry.rules())
+        self.scheduler = Scheduler(
+            self.hub.send_command, on_run=self.on_schedule_run,
+            catch_up=self.registry.get_setting("catch_up", "once")
+        )
+        self.load_schedules()
+        self.fleet_tiles = {}
+        self.dispatch = {}
+        self.menu = None
+        Clock.schedule_interval(self.flush_telemetry, 0)  # once per frame
 
-        return Builder.load_string('''
+        root = Builder.load_string('''
 MDBoxLayout:
     orientation: 'vertical'
     MDTopAppBar:
+        id: top_bar
         title: "IoT Control"
-        right_action_items: [["cog", lambda x: app.open_settings()], ["chart-bell-curve", lambda x: app.add_widget_dialog()], ["plus-box", lambda x: app.add_relay_dialog()]]
+        right_action_items: [["view-grid", lambda x: app.toggle_fleet()], ["robot", lambda x: app.open_rules()], ["palette", lambda x: app.open_scenes()], ["cog", lambda x: app.open_settings()], ["chart-bell-curve", lambda x: app.add_widget_dialog()], ["plus-box", lambda x: app.add_relay_dialog()]]
     MDLabel:
         id: conn_warning
         text: "⚠️ SERVER OFFLINE"
@@ -117,60 +370,80 @@ MDBoxLayout:
         opacity: 0
         md_bg_color: 0.8, 0, 0, 1
         color: 1, 1, 1, 1
-    MDBoxLayout:
-        orientation: 'horizontal'
-        size_hint_y: None
-        height: "65dp"
-        padding: "10dp"
-        spacing: "10dp"
-        MDRaisedButton:
-            id: drop_item
-            text: app.device_id
-            size_hint_x: 0.5
-            font_size: "18sp"
-            on_release: app.menu.open()
-        MDIconButton:
-            icon: "plus-circle"
-            on_release: app.add_device_dialog()
-        MDIconButton:
-            icon: "delete-forever"
-            theme_text_color: "Error"
-            on_release: app.remove_device_confirm()
-    ScrollView:
-        MDBoxLayout:
-            id: scroll_content
-            orientation: 'vertical'
-            adaptive_height: True
-            padding: "15dp"
-            spacing: "15dp"
-            MDLabel:
-                text: "SENSORS"
-                font_style: "Button"
-                theme_text_color: "Secondary"
-                size_hint_y: None
-                height: "30dp"
-            MDBoxLayout:
-                id: sensor_container
-                orientation: 'vertical'
-                adaptive_height: True
-                spacing: "10dp"
-            MDLabel:
-                text: "RELAYS"
-                font_style: "Button"
-                theme_text_color: "Secondary"
-                size_hint_y: None
-                height: "30dp"
+    ScreenManager:
+        id: screens
+        Screen:
+            name: "device"
             MDBoxLayout:
-                id: relay_container
                 orientation: 'vertical'
-                adaptive_height: True
-                spacing: "10dp"
+                MDBoxLayout:
+                    orientation: 'horizontal'
+                    size_hint_y: None
+                    height: "65dp"
+                    padding: "10dp"
+                    spacing: "10dp"
+                    MDRaisedButton:
+                        id: drop_item
+                        text: app.device_id
+                        size_hint_x: 0.5
+                        font_size: "18sp"
+                        on_release: app.open_device_menu()
+                    MDIconButton:
+                        icon: "plus-circle"
+                        on_release: app.add_device_dialog()
+                    MDIconButton:
+                        icon: "calendar-clock"
+                        on_release: app.open_schedules()
+                    MDIconButton:
+                        icon: "delete-forever"
+                        theme_text_color: "Error"
+                        on_release: app.remove_device_confirm()
+                ScrollView:
+                    MDBoxLayout:
+                        id: scroll_content
+                        orientation: 'vertical'
+                        adaptive_height: True
+                        padding: "15dp"
+                        spacing: "15dp"
+                        MDLabel:
+                            text: "SENSORS"
+                            font_style: "Button"
+                            theme_text_color: "Secondary"
+                            size_hint_y: None
+                            height: "30dp"
+                        MDBoxLayout:
+                            id: sensor_container
+                            orientation: 'vertical'
+                            adaptive_height: True
+                            spacing: "10dp"
+                        MDLabel:
+                            text: "RELAYS"
+                            font_style: "Button"
+                            theme_text_color: "Secondary"
+                            size_hint_y: None
+                            height: "30dp"
+                        MDBoxLayout:
+                            id: relay_container
+                            orientation: 'vertical'
+                            adaptive_height: True
+                            spacing: "10dp"
+        Screen:
+            name: "fleet"
+            ScrollView:
+                MDGridLayout:
+                    id: fleet_grid
+                    cols: max(1, int(self.width / dp(170)))
+                    adaptive_height: True
+                    padding: "15dp"
+                    spacing: "10dp"
 ''')
+        startup.mark("build")
+        return root
 
     def on_start(self):
-        self.setup_menu()
         self.render_all()
-        Clock.schedule_once(self.reveal_app, 0.4)
+        # Show the window as soon as the first frame is ready, then connect MQTT
+        Clock.schedule_once(self.reveal_app, 0)
 
     def reveal_app(self, dt):
         Window.show()
@@ -179,48 +452,217 @@ MDBoxLayout:
                 pyi_splash.close()
             except Exception:
                 pass
+        startup.mark("first_frame")
+        Clock.schedule_once(self.start_hub, 0)
+
+    def start_hub(self, dt):
+        self.show_connection(self.hub.state)
+        self.reconnect_hub()
+        self.hub.start_probe()
+
+    def show_connection(self, state):
+        # Driven by the SDK's connection events, no polling
+        if state in ("connected", "partial"):
+            # Missed schedules are caught up once a broker is actually reachable,
+            # jobs for sites that are still down are dropped by the presence check
+            if not self.scheduler.running:
+                self.scheduler.start()
+            self.show_link(self.hub.rtt_ms, self.hub.degraded)
+            return
+        if state == "reconnecting":
+            self.set_banner("⏳ RECONNECTING...")
+        else:
+            self.set_banner("⚠️ SERVER OFFLINE")
+        self.show_link(None, False)
+
+    def show_link(self, rtt, degraded):
+        latency = f"  ·  {rtt:.0f} ms" if rtt is not None else ""
+        self.root.ids.top_bar.title = self.screen_title + latency
+        state = self.hub.state
+        if state not in ("connected", "partial"):
+            return
+        if degraded:
+            self.set_banner(f"⚠️ SLOW LINK ({rtt:.0f} ms)" if rtt is not None else "⚠️ BROKER NOT RESPONDING")
+        elif state == "partial":
+            up, total = self.hub.sites_up
+            self.set_banner(f"⚠️ {up}/{total} SITES ONLINE")
+        else:
+            self.set_banner(None)
 
-    def check_connection(self, dt):
-        if not self.hub.is_connected():
-            self.root.ids.conn_warning.height = "35dp"
-            self.root.ids.conn_warning.opacity = 1
+    def set_banner(self, text):
+        warning = self.root.ids.conn_warning
+        if text:
+            warning.text = text
+            warning.height = "35dp"
+            warning.opacity = 1
         else:
-            self.root.ids.conn_warning.height = 0
-            self.root.ids.conn_warning.opacity = 0
+            warning.height = 0
+            warning.opacity = 0
+
+    def on_stop(self):
+        self.scheduler.stop()
+        self.hub.stop_probe()
+        print(f"Telemetry: {self.telemetry.messages_merged} messages merged, "
+              f"{self.telemetry.frames_skipped} frames skipped")
 
     def on_telemetry_callback(self, dev_id, data, timestamp):
-        Clock.schedule_once(lambda dt: self.update_widgets(dev_id, data))
+        # Runs on paho's thread: only hand the frame over, never touch widgets here.
+        # Automation rules are evaluated right away, they don't wait for a frame.
+        self.rules.process(dev_id, data)
+        self.telemetry.put(dev_id, data, timestamp)
+
+    def on_replay_callback(self, dev_id, data, timestamp):
+        # Frames the device buffered while offline: hours-old readings must not
+        # fire rules or overwrite the cards, they only go into the history.
+        # Without a synced timestamp there is no telling when they were measured.
+        if timestamp is not None:
+            self.telemetry.put(dev_id, data, timestamp, replayed=True)
+
+    def flush_telemetry(self, dt):
+        for dev_id, (data, timestamp) in self.telemetry.drain(self.record_history).items():
+            if "first_telemetry" not in startup.marks:
+                startup.mark("first_telemetry")
+                print("Startup timeline:", startup.summary())
+            self.fleet.update(dev_id, data)
+            self.update_widgets(dev_id, data)
+
+    def toggle_fleet(self):
+        screens = self.root.ids.screens
+        if screens.current == "fleet":
+            self.show_device_screen()
+            return
+        screens.current = "fleet"
+        self.screen_title = "Fleet"
+        self.show_link(self.hub.rtt_ms, self.hub.degraded)
+        self.build_fleet_tiles()
+        self.refresh_fleet(0, full=True)
+        # Redraws are throttled to once per second, whatever the telemetry rate
+        self.fleet_event = Clock.schedule_interval(self.refresh_fleet, 1)
+
+    def show_device_screen(self):
+        if getattr(self, "fleet_event", None):
+            self.fleet_event.cancel()
+            self.fleet_event = None
+        self.root.ids.screens.current = "device"
+        self.screen_title = "IoT Control"
+        self.show_link(self.hub.rtt_ms, self.hub.degraded)
+
+    def open_from_fleet(self, dev_id):
+        self.show_device_screen()
+        self.set_device(dev_id)
+
+    def build_fleet_tiles(self):
+        grid = self.root.ids.fleet_grid
+        for dev_id in list(self.fleet_tiles):
+            if dev_id not in self.device_options:
+                grid.remove_widget(self.fleet_tiles.pop(dev_id))
+        for dev_id in self.device_options:
+            if dev_id not in self.fleet_tiles:
+                tile = self.fleet_tiles[dev_id] = FleetTile(dev_id, on_open=self.open_from_fleet)
+                grid.add_widget(tile)
+
+    def refresh_fleet(self, dt, full=False):
+        now = time.time()
+        changed = set(self.fleet_tiles) if full else self.fleet.take_dirty()
+        if full:
+            self.fleet.take_dirty()
+
+        for dev_id in changed:
+            tile = self.fleet_tiles.get(dev_id)
+            st = self.fleet.devices.get(dev_id)
+            if tile is None or st is None:
+                continue
+            keys = [s["key"] for s in self.registry.sensors(dev_id)] or list(st.values)
+            tile.set_values("  ".join(f"{k}: {st.values[k]}" for k in keys[:3] if k in st.values))
+
+        presence = self.hub.presence
+        for dev_id, tile in self.fleet_tiles.items():
+            # Status messages (Last Will) win, the last-seen age covers older firmware
+            if dev_id in presence.online or dev_id in presence.offline:
+                tile.set_online(presence.is_online(dev_id))
+            else:
+                tile.set_online(self.fleet.is_online(dev_id, now))
+            age = format_age(self.fleet.age(dev_id, now))
+            parts = [age]
+            link = self.hub.link_stats(dev_id)
+            if link:
+                parts.append(f"{link['loss_rate']:.1%} loss")
+            latency = self.hub.latency(dev_id)
+            if latency:
+                parts.append(f"{latency['avg_ms']:.0f} ms")
+            tile.set_age(" · ".join(parts))
+
+    def record_history(self, dev_id, data, timestamp):
+        # Every raw frame goes into the chart history, even the ones merged away.
+        # `timestamp` is the device's clock-synced send time, None for unsynced devices.
+        self.history.add(dev_id, data, timestamp)
 
     def update_widgets(self, dev_id, data):
         if dev_id != self.device_id:
             return
+        # Dispatch table built by render_all: only the cards of the keys in the frame are touched
+        dispatch = self.dispatch
+        for key, value in data.items():
+            for handler, widget in dispatch.get(key, ()):
+                handler(widget, value)
+
+    def show_sensor(self, widget, value):
+        widget.val_label.text = f"{value} {widget.unit}"
+        if widget.chart:
+            widget.chart.refresh()
 
-        for widget in self.root.ids.sensor_container.children:
-            if isinstance(widget, SensorCard):
-                val = data.get(widget.data_key, "--")
-                unit = next((s['unit'] for s in self.sensor_data.get(self.device_id, [])
-                             if s['key'] == widget.data_key), "")
-                widget.val_label.text = f"{val} {unit}"
-
-        for widget in self.root.ids.relay_container.children:
-            if isinstance(widget, RelayCard):
-                if widget.cmd in data:
-                    device_state = str(data[widget.cmd]).lower()
-                    if device_state in ("on", "off"):
-                        widget.card_state = device_state
-                        widget.update_visual()
-                        for r in self.device_data.get(self.device_id, []):
-                            if r["cmd"] == widget.cmd:
-                                r["state"] = device_state
-
-        self.save_data()
+    def show_relay(self, widget, value):
+        device_state = str(value).lower()
+        if device_state in ("on", "off"):
+            widget.card_state = device_state
+            widget.update_visual()
+            self.registry.set_relay_state(self.device_id, widget.cmd, device_state)
+
+    def show_dimmer(self, widget, value):
+        level = to_level(value)
+        if level is None:
+            return
+        widget.set_level(level)
+        self.registry.set_relay_state(self.device_id, widget.cmd, str(level))
+
+    def apply_manifest(self, dev_id, manifest):
+        """Creates the cards a device announces that don't exist yet, never removes any."""
+        if dev_id not in self.device_options:
+            return
+        sensors = {s["key"] for s in self.registry.sensors(dev_id)}
+        relays = {r["cmd"] for r in self.registry.relays(dev_id)}
+        added = 0
+        for field in manifest.sensors():
+            if field["key"] not in sensors:
+                self.registry.add_sensor(
+                    dev_id, name=field.get("name") or field["key"], key=field["key"], unit=field.get("unit", "")
+                )
+                added += 1
+        for field in manifest.actuators():
+            if field["key"] not in relays:
+                dimmer = field["kind"] == "dimmer"
+                self.registry.add_relay(
+                    dev_id, name=field.get("name") or field["key"], cmd=field["key"],
+                    state="0" if dimmer else "off", kind=field["kind"]
+                )
+                added += 1
+        if added:
+            print(f"Manifest: added {added} cards for {dev_id}")
+            if dev_id == self.device_id:
+                self.render_all()
 
     def open_settings(self, *args):
-        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="350dp")
+        from kivymd.uix.button import MDFlatButton, MDRectangleFlatIconButton
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="470dp")
 
         self.set_broker = MDTextField(text=self.mqtt_broker, hint_text="Broker IP")
         self.set_port = MDTextField(text=str(self.mqtt_port), hint_text="Port", input_filter="int")
         self.set_mqtt = MDTextField(text=self.mqtt_id, hint_text="Device MQTT ID")
+        self.set_catch_up = MDTextField(text=self.scheduler.catch_up, hint_text="Missed schedules: skip / once / all")
+        self.set_rate = MDTextField(text=str(self.stream_rate), hint_text="Slider updates per second", input_filter="int")
 
         self.theme_btn = MDRaisedButton(
             text=f"Theme: {self.theme_cls.theme_style}",
@@ -238,6 +680,8 @@ MDBoxLayout:
         box.add_widget(self.set_broker)
         box.add_widget(self.set_port)
         box.add_widget(self.set_mqtt)
+        box.add_widget(self.set_catch_up)
+        box.add_widget(self.set_rate)
         box.add_widget(self.theme_btn)
         box.add_widget(self.about_btn)
 
@@ -253,6 +697,9 @@ MDBoxLayout:
         self.dialog.open()
 
     def show_about_info(self, *args):
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
         about_dialog = MDDialog(
             title="App Info",
             text="APP version: 1.1\nSDK version: 1.0",
@@ -264,73 +711,351 @@ MDBoxLayout:
         self.mqtt_broker = self.set_broker.text.strip()
         self.mqtt_port = int(self.set_port.text) if self.set_port.text.strip() else 1883
         self.mqtt_id = self.set_mqtt.text.strip() if self.set_mqtt.text.strip() else "None"
-        self.save_data()
+        self.registry.update_settings({"broker": self.mqtt_broker, "port": self.mqtt_port, "id": self.mqtt_id})
+        catch_up = self.set_catch_up.text.strip().lower()
+        if catch_up in CATCH_UP_POLICIES:
+            self.scheduler.catch_up = catch_up
+            self.registry.set_setting("catch_up", catch_up)
+        if self.set_rate.text.strip() and int(self.set_rate.text) > 0:
+            self.stream_rate = int(self.set_rate.text)
+            self.registry.set_setting("stream_rate", self.stream_rate)
         self.dialog.dismiss()
         self.reconnect_hub()
 
     def reconnect_hub(self):
-        self.hub.disconnect()
+        # Only the connections whose broker changed are restarted, other sites stay up
+        self.hub.reconfigure(self.mqtt_id, self.mqtt_broker, self.mqtt_port)
 
-        # FIX: Use hub.id (not hub.mqtt_id) to match sdk.py's attribute name
-        self.hub.id = self.mqtt_id
-        self.hub.broker = self.mqtt_broker
-        self.hub.port = self.mqtt_port
+        # Subscriptions are queued per broker and sent once each connection is ready
+        if self.device_id != "None":
+            self.hub.subscribe_telemetry(self.device_id)
+        self.subscribe_fleet()
 
-        # Update the command topic to match the new device id
-        self.hub.cmd_topic = f"devices/{self.mqtt_id}/commands"
+    def subscribe_fleet(self):
+        # Devices referenced by automation rules are watched even without cards
+        self.hub.subscribe_fleet(set(self.device_options) | self.rules.devices())
 
-        self.hub.connect()
+    def open_rules(self, *args):
+        from kivy.uix.scrollview import ScrollView
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
 
-        # subscribe_telemetry now safely handles not-yet-connected state;
-        # _on_connect will finalize the subscription when ready
-        if self.device_id != "None":
-            self.hub.subscribe_telemetry(self.device_id)
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="400dp")
+        self.rule_in = MDTextField(
+            hint_text="Rule", helper_text="if pico_01.temp > 30 for 60s then relay1 on", helper_text_mode="persistent"
+        )
+        box.add_widget(self.rule_in)
+        box.add_widget(MDRaisedButton(text="ADD RULE", on_release=self.confirm_rule))
 
-    def load_data(self):
-        if os.path.exists(self.config_path):
-            with open(self.config_path, "r") as f:
-                d = json.load(f)
-                self.mqtt_broker = d.get("broker", "192.168.1.3")
-                self.mqtt_port = d.get("port", 1883)
-                self.mqtt_id = d.get("id", "default_device")
-                self.theme_cls.theme_style = d.get("theme", "Dark")
-                self.device_options = d.get("devices", [])
-                self.device_data = d.get("relay_map", {})
-                self.sensor_data = d.get("sensor_map", {})
+        self.rule_list = MDBoxLayout(orientation="vertical", adaptive_height=True, spacing="6dp")
+        scroll = ScrollView()
+        scroll.add_widget(self.rule_list)
+        box.add_widget(scroll)
+        self.render_rules()
+
+        self.dialog = MDDialog(
+            title="Automation", type="custom", content_cls=box,
+            buttons=[MDFlatButton(text="CLOSE", on_release=lambda x: self.dialog.dismiss())]
+        )
+        self.dialog.open()
+
+    def render_rules(self):
+        self.rule_list.clear_widgets()
+        for rule_id, rule in self.rules.rules.items():
+            st = rule.stats()
+            row = MDBoxLayout(orientation="horizontal", size_hint_y=None, height="56dp")
+            row.add_widget(MDLabel(
+                text=f"{rule.text}\n[size=11sp]{st['fires']} fired, {st['evaluations']} checks, "
+                     f"{st['avg_us']:.1f} us avg[/size]",
+                markup=True, font_style="Caption"
+            ))
+            row.add_widget(MDIconButton(
+                icon="trash-can", theme_text_color="Error", on_release=lambda x, r=rule_id: self.remove_rule(r)
+            ))
+            self.rule_list.add_widget(row)
+
+    def confirm_rule(self, *args):
+        text = self.rule_in.text.strip()
+        if not text:
+            return
+        try:
+            Rule(text)
+        except ValueError as e:
+            self.rule_in.error = True
+            self.rule_in.helper_text = str(e)
+            return
+        self.rules.add(text, self.registry.add_rule(text))
+        self.rule_in.text = ""
+        self.rule_in.error = False
+        self.subscribe_fleet()
+        self.render_rules()
+
+    def remove_rule(self, rule_id):
+        self.registry.remove_rule(rule_id)
+        self.rules.remove(rule_id)
+        self.subscribe_fleet()
+        self.render_rules()
+
+    def load_schedules(self):
+        for row in self.registry.schedules():
+            try:
+                job = Job(row["id"], row["device_id"], row["cmd"], row["value"], row["spec"],
+                          next_run=row["next_run"], last_run=row["last_run"])
+            except ValueError as e:
+                print(f"Scheduler: skipping schedule {row['id']}: {e}")
+                continue
+            self.scheduler.add(job)
+
+    def on_schedule_run(self, job):
+        # Called from the scheduler thread, the registry is only used from the Kivy thread
+        Clock.schedule_once(lambda dt: self.persist_schedule(job))
+
+    def persist_schedule(self, job):
+        if job.next_run is None:
+            self.registry.remove_schedule(job.id)
+        else:
+            self.registry.update_schedule_run(job.id, job.next_run, job.last_run)
+
+    def open_schedules(self, *args):
+        if self.device_id == "None":
+            return
+        from kivy.uix.scrollview import ScrollView
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="420dp")
+        self.sch_cmd = MDTextField(hint_text="Command")
+        self.sch_value = MDTextField(hint_text="Value", text="on")
+        self.sch_spec = MDTextField(
+            hint_text="When", helper_text="at 2026-10-20 07:00 / every 10m / cron 30 7 * * 1-5",
+            helper_text_mode="persistent"
+        )
+        for w in (self.sch_cmd, self.sch_value, self.sch_spec):
+            box.add_widget(w)
+        box.add_widget(MDRaisedButton(text="ADD SCHEDULE", on_release=self.confirm_schedule))
+
+        self.schedule_list = MDBoxLayout(orientation="vertical", adaptive_height=True, spacing="6dp")
+        scroll = ScrollView()
+        scroll.add_widget(self.schedule_list)
+        box.add_widget(scroll)
+        self.render_schedules()
+
+        self.dialog = MDDialog(
+            title=f"Schedules: {self.device_id}", type="custom", content_cls=box,
+            buttons=[MDFlatButton(text="CLOSE", on_release=lambda x: self.dialog.dismiss())]
+        )
+        self.dialog.open()
+
+    def render_schedules(self):
+        self.schedule_list.clear_widgets()
+        for row in self.registry.schedules(self.device_id):
+            job = self.scheduler.jobs.get(row["id"])
+            next_run = job.next_run if job else row["next_run"]
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(next_run)) if next_run else "done"
+            line = MDBoxLayout(orientation="horizontal", size_hint_y=None, height="48dp")
+            line.add_widget(MDLabel(
+                text=f"{row['cmd']} {row['value']}  ({row['spec']})\n[size=11sp]next: {when}[/size]",
+                markup=True, font_style="Caption"
+            ))
+            line.add_widget(MDIconButton(
+                icon="trash-can", theme_text_color="Error",
+                on_release=lambda x, i=row["id"]: self.remove_schedule(i)
+            ))
+            self.schedule_list.add_widget(line)
+
+    def confirm_schedule(self, *args):
+        cmd = self.sch_cmd.text.strip()
+        value = self.sch_value.text.strip()
+        spec = self.sch_spec.text.strip()
+        if not cmd or not value:
+            return
+        try:
+            job = Job(None, self.device_id, cmd, value, spec)
+        except ValueError as e:
+            self.sch_spec.error = True
+            self.sch_spec.helper_text = str(e)
+            return
+        job.id = self.registry.add_schedule(self.device_id, cmd, value, spec, job.next_run)
+        self.scheduler.add(job)
+        self.sch_spec.error = False
+        self.render_schedules()
+
+    def remove_schedule(self, schedule_id):
+        self.scheduler.remove(schedule_id)
+        self.registry.remove_schedule(schedule_id)
+        self.render_schedules()
+
+    def open_scenes(self, *args):
+        from kivy.uix.scrollview import ScrollView
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="400dp")
+        self.scene_name = MDTextField(hint_text="Scene name")
+        self.scene_devices = MDTextField(
+            hint_text="Devices", helper_text="comma separated, empty = current device", helper_text_mode="persistent"
+        )
+        box.add_widget(self.scene_name)
+        box.add_widget(self.scene_devices)
+        box.add_widget(MDRaisedButton(text="SAVE CURRENT STATES", on_release=self.confirm_scene))
+
+        self.scene_list = MDBoxLayout(orientation="vertical", adaptive_height=True, spacing="6dp")
+        scroll = ScrollView()
+        scroll.add_widget(self.scene_list)
+        box.add_widget(scroll)
+        self.render_scenes()
+
+        self.dialog = MDDialog(
+            title="Scenes", type="custom", content_cls=box,
+            buttons=[MDFlatButton(text="CLOSE", on_release=lambda x: self.dialog.dismiss())]
+        )
+        self.dialog.open()
+
+    def render_scenes(self):
+        self.scene_list.clear_widgets()
+        for scene_id, name in self.registry.scenes():
+            row = MDBoxLayout(orientation="horizontal", size_hint_y=None, height="48dp")
+            label = MDBoxLayout(orientation="vertical")
+            label.add_widget(MDLabel(text=name))
+            status = self.scene_status(name)
+            if status:
+                label.add_widget(MDLabel(text=status, font_style="Caption", theme_text_color="Secondary"))
+            row.add_widget(label)
+            row.add_widget(MDIconButton(icon="play", on_release=lambda x, i=scene_id, n=name: self.fire_scene(i, n)))
+            row.add_widget(MDIconButton(
+                icon="trash-can", theme_text_color="Error", on_release=lambda x, i=scene_id: self.remove_scene(i)
+            ))
+            self.scene_list.add_widget(row)
+
+    def confirm_scene(self, *args):
+        name = self.scene_name.text.strip()
+        devices = [d.strip() for d in self.scene_devices.text.split(",") if d.strip()]
+        if not devices and self.device_id != "None":
+            devices = [self.device_id]
+        commands = {
+            dev: {r["cmd"]: r["state"] for r in self.registry.relays(dev)}
+            for dev in devices if dev in self.device_options
+        }
+        commands = {dev: cmds for dev, cmds in commands.items() if cmds}
+        if not name or not commands:
+            return
+        self.registry.add_scene(name, commands)
+        self.scene_name.text = ""
+        self.render_scenes()
+
+    def fire_scene(self, scene_id, name):
+        # One publish per device, each device switches all its relays at once and acknowledges
+        # The relay states are stored per device once it acknowledges the scene
+        commands = self.registry.scene_commands(scene_id)
+        run = self.scene_runs[name] = {
+            "pending": set(), "ok": [], "failed": [], "timeout": [], "offline": [], "commands": commands
+        }
+        for dev, cmds in commands.items():
+            if self.hub.send_scene(dev, cmds, name):
+                run["pending"].add(dev)
+            else:
+                run["offline"].append(dev)
+        if run["pending"]:
+            Clock.schedule_once(lambda dt: self.scene_timeout(name, run), SCENE_ACK_TIMEOUT)
+        self.refresh_scenes()
+
+    def on_scene_ack(self, dev_id, data):
+        run = self.scene_runs.get(data.get("scene"))
+        if run is None or dev_id not in run["pending"]:
+            return  # not ours, or it arrived after the timeout
+        run["pending"].discard(dev_id)
+        if data.get("error"):
+            run["failed"].append(dev_id)
+            print(f"Scene {data.get('scene')}: {dev_id} failed: {data['error']}")
         else:
-            self.mqtt_broker = "192.168.1.3"
-            self.mqtt_id = "default_device"
-            self.mqtt_port = 1883
-            self.theme_cls.theme_style = "Dark"
-            self.device_options, self.device_data, self.sensor_data = [], {}, {}
+            run["ok"].append(dev_id)
+            for cmd, value in run["commands"][dev_id].items():
+                self.registry.set_relay_state(dev_id, cmd, value)
+            if dev_id == self.device_id:
+                self.render_all()
+        self.refresh_scenes()
+
+    def scene_timeout(self, name, run):
+        if self.scene_runs.get(name) is not run or not run["pending"]:
+            return  # fired again since, or fully acknowledged
+        run["timeout"].extend(sorted(run["pending"]))
+        run["pending"].clear()
+        print(f"Scene {name}: no ack from {', '.join(run['timeout'])}")
+        self.refresh_scenes()
+
+    def scene_status(self, name):
+        run = self.scene_runs.get(name)
+        if run is None:
+            return ""
+        if run["pending"]:
+            return f"⏳ Waiting for {len(run['pending'])} device(s)"
+        problems = [
+            f"{label}: {', '.join(run[key])}"
+            for key, label in (("failed", "failed"), ("timeout", "no ack"), ("offline", "offline")) if run[key]
+        ]
+        if problems:
+            return "⚠️ " + "  ·  ".join(problems)
+        return f"✓ Applied on {len(run['ok'])} device(s)"
+
+    def refresh_scenes(self):
+        # Only while the Scenes dialog is open
+        scene_list = getattr(self, "scene_list", None)
+        if scene_list is not None and scene_list.get_root_window() is not None:
+            self.render_scenes()
+
+    def remove_scene(self, scene_id):
+        self.registry.remove_scene(scene_id)
+        self.render_scenes()
+
+    def load_data(self):
+        # Only settings and device ids are loaded here, cards are read per device on demand
+        reg = self.registry
+        self.mqtt_broker = reg.get_setting("broker", "192.168.1.3")
+        self.mqtt_port = reg.get_setting("port", 1883)
+        self.mqtt_id = reg.get_setting("id", "default_device")
+        self.theme_cls.theme_style = reg.get_setting("theme", "Dark")
+        self.stream_rate = reg.get_setting("stream_rate", 10)
+        self.device_options = reg.devices()
 
     def toggle_theme(self, *args):
         self.theme_cls.theme_style = (
             "Light" if self.theme_cls.theme_style == "Dark" else "Dark"
         )
-        self.save_data()
+        self.registry.set_setting("theme", self.theme_cls.theme_style)
         if hasattr(self, 'theme_btn'):
             self.theme_btn.text = f"Theme: {self.theme_cls.theme_style}"
 
     def migrate_old_config(self):
-        if not os.path.exists(self.config_path):
+        migrated_path = self.config_path + ".migrated"
+        if not os.path.exists(self.config_path) and not os.path.exists(migrated_path):
             if os.path.exists(self.old_config_path):
                 shutil.copy(self.old_config_path, self.config_path)
                 print("Old config migrated to new app storage.")
 
-    def save_data(self):
-        with open(self.config_path, "w") as f:
-            json.dump({
-                "broker": self.mqtt_broker,
-                "port": self.mqtt_port,
-                "id": self.mqtt_id,
-                "theme": self.theme_cls.theme_style,
-                "devices": self.device_options,
-                "relay_map": self.device_data,
-                "sensor_map": self.sensor_data
-            }, f, indent=4)
+        # One-time import of config.json into the SQLite registry
+        if os.path.exists(self.config_path):
+            with open(self.config_path, "r") as f:
+                self.registry.import_config(json.load(f))
+            os.replace(self.config_path, migrated_path)
+            print("config.json migrated to the device registry.")
 
     def setup_menu(self):
+        # The device menu is rebuilt lazily on its next open
+        if self.menu:
+            self.menu.dismiss()
+        self.menu = None
+
+    def open_device_menu(self):
+        if self.menu is None:
+            self.menu = self.build_device_menu()
+        self.menu.open()
+
+    def build_device_menu(self):
+        from kivymd.uix.menu import MDDropdownMenu
+
         items = [
             {
                 "viewclass": "OneLineListItem",
@@ -339,12 +1064,14 @@ MDBoxLayout:
             }
             for i in self.device_options
         ]
-        self.menu = MDDropdownMenu(caller=self.root.ids.drop_item, items=items, width=170)
+        return MDDropdownMenu(caller=self.root.ids.drop_item, items=items, width=170)
 
     def set_device(self, choice):
         self.device_id = choice
-        self.menu.dismiss()
-        self.reconnect_hub()
+        if self.menu:
+            self.menu.dismiss()
+        # Switching devices only moves the telemetry focus, the connection stays up
+        self.hub.subscribe_telemetry(choice)
         self.render_all()
 
     def render_all(self):
@@ -353,46 +1080,78 @@ MDBoxLayout:
         sen_con = self.root.ids.sensor_container
         rel_con.clear_widgets()
         sen_con.clear_widgets()
+        self.dispatch = {}  # telemetry key -> [(handler, card)]
 
-        for r in self.device_data.get(self.device_id, []):
+        for r in self.registry.relays(self.device_id):
             state = r.get("state", "off")
-            rel_con.add_widget(RelayCard(
-                name=r["name"], cmd=r["cmd"], state=state,
-                on_remove=self.remove_relay, on_power=self.send_cmd
-            ))
+            if r.get("kind") == "dimmer":
+                card = DimmerCard(
+                    name=r["name"], cmd=r["cmd"], level=to_level(state) or 0,
+                    on_remove=self.remove_relay, on_level=self.send_level
+                )
+                self.dispatch.setdefault(r["cmd"], []).append((self.show_dimmer, card))
+            else:
+                card = RelayCard(
+                    name=r["name"], cmd=r["cmd"], state=state,
+                    on_remove=self.remove_relay, on_power=self.send_cmd
+                )
+                self.dispatch.setdefault(r["cmd"], []).append((self.show_relay, card))
+            rel_con.add_widget(card)
 
-        for s in self.sensor_data.get(self.device_id, []):
-            sen_con.add_widget(SensorCard(
+        for s in self.registry.sensors(self.device_id):
+            card = SensorCard(
                 name=s["name"], data_key=s["key"], unit=s["unit"],
-                on_remove=self.remove_sensor
-            ))
+                on_remove=self.remove_sensor, history=self.history,
+                dev_id=self.device_id, chart_minutes=s.get("chart", 0)
+            )
+            self.dispatch.setdefault(s["key"], []).append((self.show_sensor, card))
+            sen_con.add_widget(card)
 
     def send_cmd(self, cmd, state):
-        for r in self.device_data.get(self.device_id, []):
-            if r["cmd"] == cmd:
-                r["state"] = state
-        self.save_data()
-        self.hub.send_command(self.device_id, cmd, state)
+        """Returns False (nothing stored) when the command was dropped for an offline device."""
+        if not self.hub.send_command(self.device_id, cmd, state):
+            self.notify(f"{self.device_id} is offline, command not sent")
+            return False
+        self.registry.set_relay_state(self.device_id, cmd, state)
+        return True
+
+    def send_level(self, cmd, level, final):
+        # Latest value wins: intermediate drag positions are dropped by the stream,
+        # the last one is always delivered
+        stream = self.hub.stream(self.device_id, cmd, self.stream_rate)
+        stream.push(level)
+        if not final:
+            return
+        stream.flush()
+        if stream.delivered:
+            self.registry.set_relay_state(self.device_id, cmd, str(level))
+            return
+        # Dropped for an offline device: the slider goes back to the stored level
+        stored = next((r["state"] for r in self.registry.relays(self.device_id) if r["cmd"] == cmd), "0")
+        for handler, card in self.dispatch.get(cmd, ()):
+            if handler == self.show_dimmer:
+                card.set_level(to_level(stored) or 0, force=True)
+        self.notify(f"{self.device_id} is offline, level not sent")
+
+    def notify(self, text):
+        from kivymd.toast import toast
+
+        toast(text)
 
     def remove_relay(self, n, c):
-        self.device_data[self.device_id] = [
-            r for r in self.device_data.get(self.device_id, [])
-            if not (r["name"] == n and r["cmd"] == c)
-        ]
-        self.save_data()
+        self.registry.remove_relay(self.device_id, n, c)
         self.render_all()
 
     def remove_sensor(self, n, k):
-        self.sensor_data[self.device_id] = [
-            s for s in self.sensor_data.get(self.device_id, [])
-            if not (s["name"] == n and s["key"] == k)
-        ]
-        self.save_data()
+        self.registry.remove_sensor(self.device_id, n, k)
         self.render_all()
 
     def remove_device_confirm(self):
         if self.device_id == "None":
             return
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
         self.dialog = MDDialog(
             title=f"Delete {self.device_id}?",
             text="Wipes all settings for this device.",
@@ -407,29 +1166,53 @@ MDBoxLayout:
         target = self.device_id
         if target in self.device_options:
             self.device_options.remove(target)
-            self.device_data.pop(target, None)
-            self.sensor_data.pop(target, None)
+            self.registry.remove_device(target)
+            self.scheduler.remove_device(target)
+            self.fleet.forget(target)
+            self.hub.forget(target)
+            self.subscribe_fleet()
         self.device_id = self.device_options[0] if self.device_options else "None"
-        self.save_data()
         self.setup_menu()
         self.render_all()
         self.dialog.dismiss()
 
     def add_device_dialog(self):
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="140dp")
         self.field = MDTextField(hint_text="Device ID")
+        self.dev_broker = MDTextField(
+            hint_text="Broker (host:port)", helper_text="Empty for the default broker",
+            helper_text_mode="persistent"
+        )
+        box.add_widget(self.field)
+        box.add_widget(self.dev_broker)
         self.dialog = MDDialog(
-            title="Add Device", type="custom", content_cls=self.field,
+            title="Add Device", type="custom", content_cls=box,
             buttons=[MDRaisedButton(text="ADD", on_release=self.confirm_dev)]
         )
         self.dialog.open()
 
     def confirm_dev(self, *args):
         name = self.field.text.strip()
+        broker = self.dev_broker.text.strip()
+        try:
+            site = parse_broker(broker, self.mqtt_port) if broker else None
+        except ValueError as e:
+            self.dev_broker.error = True
+            self.dev_broker.helper_text = str(e)
+            return
         if name and name not in self.device_options:
             self.device_options.append(name)
-            self.device_data[name] = []
-            self.sensor_data[name] = []
-            self.save_data()
+            self.registry.add_device(name, f"{site[0]}:{site[1]}" if site else "")
+            if site:
+                self.hub.set_route(name, *site)
+            # Retained manifests of every device are already here
+            manifest = self.hub.manifests.get(name)
+            if manifest:
+                self.apply_manifest(name, manifest)
+            self.subscribe_fleet()
             self.setup_menu()
             self.set_device(name)
         self.dialog.dismiss()
@@ -437,13 +1220,22 @@ MDBoxLayout:
     def add_widget_dialog(self):
         if self.device_id == "None":
             return
-        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="180dp")
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="240dp")
         self.s_name = MDTextField(hint_text="Label")
         self.s_key = MDTextField(hint_text="JSON Key")
+        manifest = self.hub.manifests.get(self.device_id)
+        if manifest and manifest.sensors():
+            self.s_key.helper_text = "Device reports: " + ", ".join(f["key"] for f in manifest.sensors())
+            self.s_key.helper_text_mode = "persistent"
         self.s_unit = MDTextField(hint_text="Unit")
+        self.s_chart = MDTextField(hint_text="Chart minutes (empty = no chart)", input_filter="int")
         box.add_widget(self.s_name)
         box.add_widget(self.s_key)
         box.add_widget(self.s_unit)
+        box.add_widget(self.s_chart)
         self.dialog = MDDialog(
             title="New Sensor Widget", type="custom", content_cls=box,
             buttons=[MDRaisedButton(text="ADD", on_release=self.confirm_sensor)]
@@ -451,23 +1243,38 @@ MDBoxLayout:
         self.dialog.open()
 
     def confirm_sensor(self, *args):
-        self.sensor_data.setdefault(self.device_id, []).append({
-            "name": self.s_name.text.strip(),
-            "key": self.s_key.text.strip(),
-            "unit": self.s_unit.text.strip()
-        })
-        self.save_data()
+        self.registry.add_sensor(
+            self.device_id,
+            name=self.s_name.text.strip(),
+            key=self.s_key.text.strip(),
+            unit=self.s_unit.text.strip(),
+            chart=int(self.s_chart.text) if self.s_chart.text.strip() else 0
+        )
         self.render_all()
         self.dialog.dismiss()
 
     def add_relay_dialog(self):
         if self.device_id == "None":
             return
-        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="120dp")
+        from kivymd.uix.dialog import MDDialog
+        from kivymd.uix.textfield import MDTextField
+
+        from kivymd.uix.selectioncontrol import MDCheckbox
+
+        box = MDBoxLayout(orientation="vertical", spacing="12dp", size_hint_y=None, height="170dp")
         self.n_in = MDTextField(hint_text="Label")
         self.c_in = MDTextField(hint_text="Command")
+        manifest = self.hub.manifests.get(self.device_id)
+        if manifest and manifest.actuators():
+            self.c_in.helper_text = "Device accepts: " + ", ".join(f["key"] for f in manifest.actuators())
+            self.c_in.helper_text_mode = "persistent"
+        self.dimmer_in = MDCheckbox(size_hint=(None, None), size=("40dp", "40dp"))
+        kind_row = MDBoxLayout(orientation="horizontal", size_hint_y=None, height="40dp")
+        kind_row.add_widget(self.dimmer_in)
+        kind_row.add_widget(MDLabel(text="Dimmer (0-100 slider)"))
         box.add_widget(self.n_in)
         box.add_widget(self.c_in)
+        box.add_widget(kind_row)
         self.dialog = MDDialog(
             title="New Control Card", type="custom", content_cls=box,
             buttons=[MDRaisedButton(text="SAVE", on_release=self.confirm_relay)]
@@ -475,12 +1282,14 @@ MDBoxLayout:
         self.dialog.open()
 
     def confirm_relay(self, *args):
-        self.device_data.setdefault(self.device_id, []).append({
-            "name": self.n_in.text.strip(),
-            "cmd": self.c_in.text.strip(),
-            "state": "off"
-        })
-        self.save_data()
+        dimmer = self.dimmer_in.active
+        self.registry.add_relay(
+            self.device_id,
+            name=self.n_in.text.strip(),
+            cmd=self.c_in.text.strip(),
+            state="0" if dimmer else "off",
+            kind="dimmer" if dimmer else "relay"
+        )
         self.render_all()
         self.dialog.dismiss()
 
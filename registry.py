@@ -0,0 +1,377 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+import json
+import sqlite3
+
+IMPORT_BATCH = 1000
+
+# Each entry upgrades the database by one version (PRAGMA user_version)
+MIGRATIONS = [
+    """
+    CREATE TABLE settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE devices (
+        id TEXT PRIMARY KEY
+    );
+    CREATE TABLE relays (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        cmd TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'off'
+    );
+    CREATE INDEX relays_by_device ON relays(device_id, cmd);
+    CREATE TABLE sensors (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        unit TEXT NOT NULL DEFAULT '',
+        chart INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX sensors_by_device ON sensors(device_id, key);
+    """,
+    """
+    CREATE TABLE rules (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE schedules (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        cmd TEXT NOT NULL,
+        value TEXT NOT NULL,
+        spec TEXT NOT NULL,
+        next_run REAL,
+        last_run REAL
+    );
+    CREATE INDEX schedules_by_device ON schedules(device_id);
+    """,
+    """
+    CREATE TABLE scenes (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL
+    );
+    CREATE TABLE scene_commands (
+        scene_id INTEGER NOT NULL REFERENCES scenes(id) ON DELETE CASCADE,
+        device_id TEXT NOT NULL,
+        cmd TEXT NOT NULL,
+        value TEXT NOT NULL
+    );
+    CREATE INDEX scene_commands_by_scene ON scene_commands(scene_id);
+    """,
+    """
+    ALTER TABLE relays ADD COLUMN kind TEXT NOT NULL DEFAULT 'relay';
+    """,
+    """
+    ALTER TABLE devices ADD COLUMN broker TEXT NOT NULL DEFAULT '';
+    """,
+]
+
+
+class DeviceRegistry:
+    """
+    SQLite store for the app settings, the device list and each device's relay
+    and sensor cards. Channels are loaded per device on first use and every
+    change only writes the rows it touches.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self._migrate()
+
+        self._relays = {}   # device_id -> cached list of relay dicts
+        self._sensors = {}  # device_id -> cached list of sensor dicts
+
+    def _migrate(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.conn:
+                self.conn.executescript(script)
+                self.conn.execute(f"PRAGMA user_version = {number}")
+
+    def close(self):
+        self.conn.close()
+
+    # ---------------- Settings ----------------
+    def get_setting(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_setting(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def update_settings(self, values):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in values.items()]
+            )
+
+    # ---------------- Devices ----------------
+    def devices(self):
+        return [row["id"] for row in self.conn.execute("SELECT id FROM devices ORDER BY rowid")]
+
+    def add_device(self, device_id, broker=""):
+        """`broker` is 'host[:port]' of the device's site, empty for the default broker."""
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO devices (id, broker) VALUES (?, ?)", (device_id, broker))
+
+    def device_brokers(self):
+        """{device_id: 'host[:port]'} of the devices that are not on the default broker."""
+        return {
+            row["id"]: row["broker"]
+            for row in self.conn.execute("SELECT id, broker FROM devices WHERE broker != ''")
+        }
+
+    def set_device_broker(self, device_id, broker):
+        with self.conn:
+            self.conn.execute("UPDATE devices SET broker = ? WHERE id = ?", (broker, device_id))
+
+    def remove_device(self, device_id):
+        """Deletes the device with its cards, schedules and scene commands (the last two have no FK)."""
+        with self.conn:
+            self.conn.execute("DELETE FROM schedules WHERE device_id = ?", (device_id,))
+            self.conn.execute("DELETE FROM scene_commands WHERE device_id = ?", (device_id,))
+            self.conn.execute("DELETE FROM devices WHERE id = ?", (device_id,))
+        self._relays.pop(device_id, None)
+        self._sensors.pop(device_id, None)
+
+    # ---------------- Relays ----------------
+    def relays(self, device_id):
+        cached = self._relays.get(device_id)
+        if cached is None:
+            cached = self._relays[device_id] = [
+                dict(row) for row in self.conn.execute(
+                    "SELECT id, name, cmd, state, kind FROM relays WHERE device_id = ? ORDER BY id", (device_id,)
+                )
+            ]
+        return cached
+
+    def add_relay(self, device_id, name, cmd, state="off", kind="relay"):
+        """`kind` is "relay" (on/off card) or "dimmer" (0-100 slider, state holds the level)."""
+        relays = self.relays(device_id)
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO relays (device_id, name, cmd, state, kind) VALUES (?, ?, ?, ?, ?)",
+                (device_id, name, cmd, state, kind)
+            )
+        relays.append({"id": cur.lastrowid, "name": name, "cmd": cmd, "state": state, "kind": kind})
+
+    def remove_relay(self, device_id, name, cmd):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM relays WHERE device_id = ? AND name = ? AND cmd = ?", (device_id, name, cmd)
+            )
+        self._relays[device_id] = [
+            r for r in self.relays(device_id) if not (r["name"] == name and r["cmd"] == cmd)
+        ]
+
+    def set_relay_state(self, device_id, cmd, state):
+        """Stores the state of every card bound to `cmd`. Returns True if anything changed."""
+        changed = [r for r in self.relays(device_id) if r["cmd"] == cmd and r["state"] != state]
+        if not changed:
+            return False
+        with self.conn:
+            self.conn.execute(
+                "UPDATE relays SET state = ? WHERE device_id = ? AND cmd = ?", (state, device_id, cmd)
+            )
+        for r in changed:
+            r["state"] = state
+        return True
+
+    # ---------------- Sensors ----------------
+    def sensors(self, device_id):
+        cached = self._sensors.get(device_id)
+        if cached is None:
+            cached = self._sensors[device_id] = [
+                dict(row) for row in self.conn.execute(
+                    "SELECT id, name, key, unit, chart FROM sensors WHERE device_id = ? ORDER BY id", (device_id,)
+                )
+            ]
+        return cached
+
+    def add_sensor(self, device_id, name, key, unit="", chart=0):
+        sensors = self.sensors(device_id)
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO sensors (device_id, name, key, unit, chart) VALUES (?, ?, ?, ?, ?)",
+                (device_id, name, key, unit, chart)
+            )
+        sensors.append(
+            {"id": cur.lastrowid, "name": name, "key": key, "unit": unit, "chart": chart}
+        )
+
+    def remove_sensor(self, device_id, name, key):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM sensors WHERE device_id = ? AND name = ? AND key = ?", (device_id, name, key)
+            )
+        self._sensors[device_id] = [
+            s for s in self.sensors(device_id) if not (s["name"] == name and s["key"] == key)
+        ]
+
+    # ---------------- Rules ----------------
+    def rules(self):
+        return [(row["id"], row["text"]) for row in self.conn.execute("SELECT id, text FROM rules ORDER BY id")]
+
+    def add_rule(self, text):
+        with self.conn:
+            return self.conn.execute("INSERT INTO rules (text) VALUES (?)", (text,)).lastrowid
+
+    def remove_rule(self, rule_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+
+    # ---------------- Schedules ----------------
+    def schedules(self, device_id=None):
+        query = "SELECT id, device_id, cmd, value, spec, next_run, last_run FROM schedules"
+        if device_id is None:
+            return [dict(row) for row in self.conn.execute(query + " ORDER BY id")]
+        return [dict(row) for row in self.conn.execute(query + " WHERE device_id = ? ORDER BY id", (device_id,))]
+
+    def add_schedule(self, device_id, cmd, value, spec, next_run):
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO schedules (device_id, cmd, value, spec, next_run) VALUES (?, ?, ?, ?, ?)",
+                (device_id, cmd, value, spec, next_run)
+            ).lastrowid
+
+    def update_schedule_run(self, schedule_id, next_run, last_run):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE schedules SET next_run = ?, last_run = ? WHERE id = ?", (next_run, last_run, schedule_id)
+            )
+
+    def remove_schedule(self, schedule_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+
+    # ---------------- Scenes ----------------
+    def scenes(self):
+        return [(row["id"], row["name"]) for row in self.conn.execute("SELECT id, name FROM scenes ORDER BY id")]
+
+    def scene_commands(self, scene_id):
+        """Returns {device_id: {cmd: value}} for one scene."""
+        commands = {}
+        for row in self.conn.execute(
+            "SELECT device_id, cmd, value FROM scene_commands WHERE scene_id = ?", (scene_id,)
+        ):
+            commands.setdefault(row["device_id"], {})[row["cmd"]] = row["value"]
+        return commands
+
+    def add_scene(self, name, commands):
+        with self.conn:
+            scene_id = self.conn.execute("INSERT INTO scenes (name) VALUES (?)", (name,)).lastrowid
+            self.conn.executemany(
+                "INSERT INTO scene_commands (scene_id, device_id, cmd, value) VALUES (?, ?, ?, ?)",
+                [(scene_id, dev, cmd, value) for dev, cmds in commands.items() for cmd, value in cmds.items()]
+            )
+        return scene_id
+
+    def remove_scene(self, scene_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM scenes WHERE id = ?", (scene_id,))
+
+    # ---------------- Bulk import / export ----------------
+    def bulk_import(self, rows):
+        """
+        Loads normalized fleet rows (see fleet_io.validate) in one transaction,
+        in batches of IMPORT_BATCH. Channels already present are left alone, and
+        nothing is written if any row fails to validate. Device rows with a
+        `broker` (not None) move the device to that broker.
+        """
+        counts = {"device": 0, "relay": 0, "dimmer": 0, "sensor": 0}
+        devices, brokers, relays, sensors = [], [], [], []
+
+        def flush():
+            self.conn.executemany("INSERT OR IGNORE INTO devices (id) VALUES (?)", devices)
+            self.conn.executemany("UPDATE devices SET broker = ? WHERE id = ?", brokers)
+            self.conn.executemany(
+                "INSERT INTO relays (device_id, name, cmd, state, kind) SELECT ?, ?, ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM relays WHERE device_id = ? AND cmd = ? AND name = ?)",
+                relays
+            )
+            self.conn.executemany(
+                "INSERT INTO sensors (device_id, name, key, unit, chart) SELECT ?, ?, ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM sensors WHERE device_id = ? AND key = ? AND name = ?)",
+                sensors
+            )
+            devices.clear()
+            brokers.clear()
+            relays.clear()
+            sensors.clear()
+
+        with self.conn:
+            for row in rows:
+                kind, dev = row["type"], row["device"]
+                counts[kind] += 1
+                devices.append((dev,))
+                if kind == "device" and row.get("broker") is not None:
+                    brokers.append((row["broker"], dev))
+                elif kind in ("relay", "dimmer"):
+                    relays.append((dev, row["name"], row["channel"], row["state"], kind,
+                                   dev, row["channel"], row["name"]))
+                elif kind == "sensor":
+                    sensors.append((dev, row["name"], row["channel"], row["unit"], row["chart"],
+                                    dev, row["channel"], row["name"]))
+                if len(devices) >= IMPORT_BATCH:
+                    flush()
+            flush()
+
+        self._relays.clear()
+        self._sensors.clear()
+        return {kind: n for kind, n in counts.items() if n}
+
+    def iter_export(self):
+        """Streams every device and channel as flat fleet rows."""
+        empty = {"name": "", "channel": "", "unit": "", "state": "", "chart": "", "broker": ""}
+        for row in self.conn.execute("SELECT id, broker FROM devices ORDER BY rowid"):
+            yield dict(empty, type="device", device=row["id"], broker=row["broker"])
+        for row in self.conn.execute("SELECT device_id, name, cmd, state, kind FROM relays ORDER BY id"):
+            yield dict(empty, type=row["kind"], device=row["device_id"], name=row["name"],
+                       channel=row["cmd"], state=row["state"])
+        for row in self.conn.execute("SELECT device_id, name, key, unit, chart FROM sensors ORDER BY id"):
+            yield dict(empty, type="sensor", device=row["device_id"], name=row["name"],
+                       channel=row["key"], unit=row["unit"], chart=row["chart"])
+
+    # ---------------- Migration ----------------
+    def import_config(self, d):
+        """Imports a legacy config.json document in a single transaction."""
+        settings = {k: d[k] for k in ("broker", "port", "id", "theme") if k in d}
+        relay_map = d.get("relay_map", {})
+        sensor_map = d.get("sensor_map", {})
+        devices = list(d.get("devices", []))
+        devices += [dev for dev in list(relay_map) + list(sensor_map) if dev not in devices]
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in settings.items()]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO devices (id) VALUES (?)", [(dev,) for dev in devices]
+            )
+            self.conn.executemany(
+                "INSERT INTO relays (device_id, name, cmd, state) VALUES (?, ?, ?, ?)",
+                [(dev, r["name"], r["cmd"], r.get("state", "off"))
+                 for dev, relays in relay_map.items() for r in relays]
+            )
+            self.conn.executemany(
+                "INSERT INTO sensors (device_id, name, key, unit, chart) VALUES (?, ?, ?, ?, ?)",
+                [(dev, s["name"], s["key"], s.get("unit", ""), s.get("chart", 0))
+                 for dev, sensors in sensor_map.items() for s in sensors]
+            )
+        self._relays.clear()
+        self._sensors.clear()
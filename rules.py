@@ -0,0 +1,182 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+import re
+import time
+
+# if pico_01.temp > 30 for 60s then relay1 on [hysteresis 1] [cooldown 5m]
+RULE_RE = re.compile(
+    r"^\s*if\s+(?P<device>[^\s.]+)\.(?P<key>\S+)\s*(?P<op>>=|<=|==|!=|>|<)\s*(?P<threshold>\S+)"
+    r"(?:\s+for\s+(?P<hold>\S+))?"
+    r"\s+then\s+(?:(?P<target>[^\s.]+)\.)?(?P<cmd>\S+)\s+(?P<value>\S+)"
+    r"(?:\s+hysteresis\s+(?P<hysteresis>\S+))?"
+    r"(?:\s+cooldown\s+(?P<cooldown>\S+))?\s*$",
+    re.IGNORECASE,
+)
+
+OPERATORS = {
+    ">": lambda v, t: v > t,
+    ">=": lambda v, t: v >= t,
+    "<": lambda v, t: v < t,
+    "<=": lambda v, t: v <= t,
+    "==": lambda v, t: v == t,
+    "!=": lambda v, t: v != t,
+}
+
+UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(text):
+    """'60s', '5m', '1h', '250ms' or a bare number of seconds."""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m|h)?", text.strip().lower())
+    if not m:
+        raise ValueError(f"Invalid duration: {text}")
+    return float(m.group(1)) * UNITS[m.group(2) or "s"]
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+class Rule:
+    """A compiled rule. Evaluation state (hold timer, armed, cooldown) lives on the rule."""
+
+    def __init__(self, text, rule_id=None):
+        m = RULE_RE.match(text)
+        if not m:
+            raise ValueError("Expected: if <device>.<key> <op> <value> [for 60s] then [<device>.]<command> <value>")
+
+        self.id = rule_id
+        self.text = text.strip()
+        self.device = m.group("device")
+        self.key = m.group("key")
+        self.op = m.group("op")
+        self.compare = OPERATORS[self.op]
+
+        raw = m.group("threshold")
+        number = _number(raw)
+        self.numeric = number is not None
+        self.threshold = number if self.numeric else raw.lower()
+
+        self.hold = parse_duration(m.group("hold")) if m.group("hold") else 0
+        self.target = m.group("target") or self.device
+        self.cmd = m.group("cmd")
+        self.value = m.group("value")
+        self.hysteresis = float(m.group("hysteresis")) if m.group("hysteresis") else 0
+        self.cooldown = parse_duration(m.group("cooldown")) if m.group("cooldown") else 0
+        if self.hysteresis and not (self.numeric and self.op in (">", ">=", "<", "<=")):
+            raise ValueError("Hysteresis needs a numeric <, <=, > or >= condition")
+
+        self.since = None       # when the condition became true
+        self.armed = True       # False after firing, until the condition clears
+        self.last_fired = None
+        self.fires = 0
+        self.evaluations = 0
+        self.eval_ns = 0
+
+    def _clears(self, value):
+        """True once the value is back past the threshold by the hysteresis margin."""
+        if not self.hysteresis:
+            return True
+        if self.op in (">", ">="):
+            return value <= self.threshold - self.hysteresis
+        return value >= self.threshold + self.hysteresis
+
+    def evaluate(self, raw, now):
+        """Feeds one value, returns True when the action must be issued."""
+        if self.numeric:
+            value = _number(str(raw))
+            if value is None:
+                return False
+        else:
+            value = str(raw).lower()
+
+        if not self.compare(value, self.threshold):
+            self.since = None
+            if not self.armed and self._clears(value):
+                self.armed = True
+            return False
+
+        if self.since is None:
+            self.since = now
+        if not self.armed or now - self.since < self.hold:
+            return False
+        if self.last_fired is not None and now - self.last_fired < self.cooldown:
+            return False
+
+        self.armed = False
+        self.last_fired = now
+        self.fires += 1
+        return True
+
+    def stats(self):
+        avg_us = self.eval_ns / self.evaluations / 1000 if self.evaluations else 0
+        return {"rule": self.text, "evaluations": self.evaluations, "avg_us": avg_us, "fires": self.fires}
+
+
+class RulesEngine:
+    """
+    Rules indexed by (device, key): each telemetry frame only evaluates the rules
+    that reference one of its keys. The index is rebuilt on change and swapped in
+    whole, so the MQTT thread can keep reading it without a lock.
+    """
+
+    def __init__(self, send_command):
+        self.send_command = send_command
+        self.rules = {}
+        self.index = {}
+
+    def add(self, text, rule_id=None):
+        rule = Rule(text, rule_id)
+        rules = dict(self.rules)
+        rules[rule_id if rule_id is not None else id(rule)] = rule
+        self._swap(rules)
+        return rule
+
+    def remove(self, rule_id):
+        rules = dict(self.rules)
+        rules.pop(rule_id, None)
+        self._swap(rules)
+
+    def load(self, rows):
+        """Replaces every rule from (id, text) rows, skipping the ones that no longer compile."""
+        rules = {}
+        for rule_id, text in rows:
+            try:
+                rules[rule_id] = Rule(text, rule_id)
+            except ValueError as e:
+                print(f"Rules: skipping rule {rule_id}: {e}")
+        self._swap(rules)
+
+    def _swap(self, rules):
+        index = {}
+        for rule in rules.values():
+            index.setdefault((rule.device, rule.key), []).append(rule)
+        self.rules = rules
+        self.index = index
+
+    def devices(self):
+        return {device for device, key in self.index}
+
+    def process(self, dev_id, data, now=None):
+        if not data:
+            return
+        index = self.index
+        now = time.time() if now is None else now
+        for key, value in data.items():
+            rules = index.get((dev_id, key))
+            if not rules:
+                continue
+            for rule in rules:
+                start = time.perf_counter_ns()
+                fire = rule.evaluate(value, now)
+                rule.eval_ns += time.perf_counter_ns() - start
+                rule.evaluations += 1
+                if fire:
+                    print(f"Rules: '{rule.text}' -> {rule.target}.{rule.cmd} {rule.value}")
+                    self.send_command(rule.target, rule.cmd, rule.value)
+
+    def stats(self):
+        return [rule.stats() for rule in self.rules.values()]
@@ -0,0 +1,260 @@
+# Copyright (C) 2026 Mohamed Akoum
+#19-10-2026
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+from rules import parse_duration
+
+# What to do with runs that were due while the app was not running
+CATCH_UP_POLICIES = ("skip", "once", "all")
+MAX_CATCH_UP_RUNS = 100
+
+
+class CronSpec:
+    """Five-field cron expression: minute hour day-of-month month day-of-week (0 or 7 = Sunday)."""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, text):
+        fields = text.split()
+        if len(fields) != 5:
+            raise ValueError("Cron needs 5 fields: minute hour day month weekday")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, lo, hi) for field, (lo, hi) in zip(fields, self.RANGES)
+        )
+        self.weekdays = {d % 7 for d in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, lo, hi):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-"))
+            else:
+                start = end = int(part)
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError(f"Cron field out of range: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        # Like cron: when both are restricted, either one matching is enough
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, ts):
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months or not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        return None
+
+
+class Job:
+    """One scheduled command. `spec` is 'at YYYY-MM-DD HH:MM', 'every 10m' or 'cron m h dom mon dow'."""
+
+    def __init__(self, job_id, device, cmd, value, spec, next_run=None, last_run=None):
+        self.id = job_id
+        self.device = device
+        self.cmd = cmd
+        self.value = value
+        self.spec = spec.strip()
+        self.last_run = last_run
+
+        kind, _, arg = self.spec.partition(" ")
+        self.kind = kind.lower()
+        if self.kind == "at":
+            self.at = datetime.strptime(arg.strip(), "%Y-%m-%d %H:%M").timestamp()
+        elif self.kind == "every":
+            self.interval = parse_duration(arg)
+            if self.interval <= 0:
+                raise ValueError("Interval must be positive")
+        elif self.kind == "cron":
+            self.cron = CronSpec(arg)
+        else:
+            raise ValueError("Expected 'at YYYY-MM-DD HH:MM', 'every <duration>' or 'cron <m h dom mon dow>'")
+
+        self.next_run = next_run if next_run is not None else self.first_run(time.time())
+
+    def first_run(self, now):
+        if self.kind == "at":
+            return self.at
+        if self.kind == "every":
+            return now + self.interval
+        return self.cron.next_after(now)
+
+    def following(self, ran_at):
+        """Next due time after a run that was due at `ran_at`, None for finished one-shots."""
+        if self.kind == "at":
+            return None
+        if self.kind == "every":
+            return ran_at + self.interval
+        return self.cron.next_after(ran_at)
+
+
+class Scheduler:
+    """
+    Priority-queue scheduler. Jobs sit in a heap ordered by due time and the
+    worker thread sleeps until the earliest one is due (or a new job arrives),
+    so nothing is scanned per tick whatever the number of schedules.
+    Removed jobs are dropped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, dispatch, on_run=None, catch_up="once"):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"catch_up must be one of {CATCH_UP_POLICIES}")
+        self.dispatch = dispatch  # dispatch(device, cmd, value)
+        self.on_run = on_run      # on_run(job) after each run, job.next_run is None when finished
+        self.catch_up = catch_up
+        self.jobs = {}
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.runs = 0
+        self.missed = 0  # runs dropped by the catch-up policy
+
+    def add(self, job):
+        with self.cond:
+            self.jobs[job.id] = job
+            if job.next_run is not None:
+                heapq.heappush(self.heap, (job.next_run, next(self.seq), job))
+            self.cond.notify()
+
+    def remove(self, job_id):
+        with self.cond:
+            self.jobs.pop(job_id, None)
+
+    def remove_device(self, device):
+        """Drops every job of `device` (deleted from the app), returns their ids."""
+        with self.cond:
+            ids = [job_id for job_id, job in self.jobs.items() if job.device == device]
+            for job_id in ids:
+                del self.jobs[job_id]
+        return ids
+
+    def start(self, now=None):
+        now = time.time() if now is None else now
+        with self.cond:
+            missed = [j for j in self.jobs.values() if j.next_run is not None and j.next_run <= now]
+        for job in missed:
+            self._catch_up(job, now)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._worker, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    @staticmethod
+    def _missed(job, due, now):
+        """
+        Occurrences of `job` from `due` up to `now`: (first due times, at most
+        MAX_CATCH_UP_RUNS of them, total count, next due time after `now`,
+        whether the count is exact). Interval jobs are counted arithmetically,
+        however long the gap.
+        """
+        if job.kind == "every":
+            count = int((now - due) // job.interval) + 1
+            times = [due + i * job.interval for i in range(min(count, MAX_CATCH_UP_RUNS))]
+            return times, count, due + count * job.interval, True
+        times = []
+        while due is not None and due <= now:
+            if len(times) == MAX_CATCH_UP_RUNS:
+                # Long cron gap: jump past it, the count is a lower bound
+                return times, len(times), job.following(now), False
+            times.append(due)
+            due = job.following(due)
+        return times, len(times), due, True
+
+    def _catch_up(self, job, now, due=None):
+        """Applies the catch-up policy to the occurrences due at or before `now`, then reschedules."""
+        due = job.next_run if due is None else due
+        times, count, next_run, exact = self._missed(job, due, now)
+        if self.catch_up == "all":
+            runs = times
+        elif self.catch_up == "once":
+            runs = times[:1]
+        else:
+            runs = []
+        for run_at in runs:
+            self._run(job, run_at)
+        self.missed += count - len(runs)
+        if count:
+            more = "" if exact else "+"
+            print(f"Scheduler: {job.device}.{job.cmd} missed {count}{more} run(s), ran {len(runs)}, policy '{self.catch_up}'")
+        self._reschedule(job, next_run)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = None
+                while self.running:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    due, _, job = self.heap[0]
+                    if self.jobs.get(job.id) is not job or job.next_run != due:
+                        heapq.heappop(self.heap)  # removed or rescheduled
+                        continue
+                    delay = due - time.time()
+                    if delay > 0:
+                        self.cond.wait(delay)
+                        continue
+                    heapq.heappop(self.heap)
+                    break
+                if not self.running:
+                    return
+
+            self._run(job, due)
+            next_run = job.following(due)
+            now = time.time()
+            if next_run is not None and next_run <= now:
+                # The process stalled (or the laptop slept): the occurrences
+                # already past follow the catch-up policy, not back to back
+                self._catch_up(job, now, next_run)
+            else:
+                self._reschedule(job, next_run)
+
+    def _run(self, job, due):
+        try:
+            self.dispatch(job.device, job.cmd, job.value)
+        except Exception as e:
+            print(f"Scheduler: dispatch failed for {job.device}.{job.cmd}: {e}")
+        job.last_run = due
+        self.runs += 1
+
+    def _reschedule(self, job, next_run):
+        with self.cond:
+            job.next_run = next_run
+            if next_run is None:
+                self.jobs.pop(job.id, None)
+            elif self.jobs.get(job.id) is job:
+                heapq.heappush(self.heap, (next_run, next(self.seq), job))
+        if self.on_run:
+            self.on_run(job)
@@ -1,9 +1,277 @@
 # Copyright (C) 2026 Mohamed Akoum
 #24-4-2026
 import json
+import random
+import threading
 import time
+from collections import deque
 import paho.mqtt.client as mqtt
 
+class PresenceIndex:
+    """
+    Online/offline state and last-seen time of every device heard from.
+    Devices report themselves through a retained status topic (with a Last Will
+    for the offline case) and any telemetry also counts as a sign of life.
+    """
+
+    def __init__(self):
+        self.last_seen = {}
+        self.online = set()
+        self.offline = set()
+
+    def update(self, dev_id, online, now=None):
+        """Returns True if the device changed state."""
+        if online:
+            self.last_seen[dev_id] = time.time() if now is None else now
+            if dev_id in self.online:
+                return False
+            self.offline.discard(dev_id)
+            self.online.add(dev_id)
+            return True
+
+        if dev_id in self.offline:
+            return False
+        self.online.discard(dev_id)
+        self.offline.add(dev_id)
+        return True
+
+    def is_online(self, dev_id):
+        return dev_id in self.online
+
+    def is_offline(self, dev_id):
+        """True only for devices known to be down (unknown devices are not offline)."""
+        return dev_id in self.offline
+
+
+class SequenceTracker:
+    """
+    Per-device telemetry sequence accounting: gaps count as lost until the
+    missing frame shows up late (then it is a reorder), frames seen twice are
+    duplicates. Gaps are kept as seq ranges, so frames replayed long after
+    (a device's offline buffer) still take their loss back. A new boot id
+    from the device starts a fresh sequence.
+    """
+
+    WINDOW = 256   # recent seqs kept for duplicate detection
+    MAX_GAPS = 64  # gap ranges remembered for late frames
+
+    def __init__(self):
+        self.boot = None
+        self.highest = None
+        self.recent = set()
+        self.recent_order = deque()
+        self.missing = []  # [first, last] seq ranges not received yet, oldest first
+        self.horizon = None  # end of the newest gap range forgotten (MAX_GAPS)
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.restarts = 0
+
+    def accept(self, seq, boot=None):
+        """Records one frame, returns False if it is a duplicate to be dropped."""
+        if boot != self.boot:
+            if self.boot is not None:
+                self.restarts += 1
+            self.boot = boot
+            self.highest = None
+            self.recent.clear()
+            self.recent_order.clear()
+            self.missing.clear()
+            self.horizon = None
+
+        if seq in self.recent:
+            self.duplicates += 1
+            return False
+
+        if self.highest is None or seq > self.highest:
+            if self.highest is not None and seq > self.highest + 1:
+                self.lost += seq - self.highest - 1
+                self.missing.append([self.highest + 1, seq - 1])
+                if len(self.missing) > self.MAX_GAPS:
+                    self.horizon = self.missing.pop(0)[1]
+            self.highest = seq
+        elif self._fill(seq):
+            self.lost -= 1
+            self.reordered += 1
+        elif self.horizon is not None and seq <= self.horizon:
+            # Late frame of a gap we no longer track, its loss can't be taken back
+            self.reordered += 1
+        else:
+            # Neither newer nor missing: received before, outside the recent window
+            self.duplicates += 1
+            return False
+
+        self.received += 1
+        self.recent.add(seq)
+        self.recent_order.append(seq)
+        if len(self.recent_order) > self.WINDOW:
+            self.recent.discard(self.recent_order.popleft())
+        return True
+
+    def _fill(self, seq):
+        """Removes `seq` from the gap ranges, False if it wasn't missing."""
+        missing = self.missing
+        for i in range(len(missing)):
+            first, last = missing[i]
+            if first <= seq <= last:
+                if first == last:
+                    del missing[i]
+                elif seq == first:
+                    missing[i][0] += 1
+                elif seq == last:
+                    missing[i][1] -= 1
+                else:
+                    missing[i:i + 1] = [[first, seq - 1], [seq + 1, last]]
+                return True
+        return False
+
+    def loss_rate(self):
+        total = self.received + self.lost
+        return self.lost / total if total else 0.0
+
+    def stats(self):
+        return {
+            "received": self.received, "lost": self.lost, "duplicates": self.duplicates,
+            "reordered": self.reordered, "restarts": self.restarts, "loss_rate": self.loss_rate(),
+        }
+
+
+class LatencyStats:
+    """End-to-end telemetry latency of one device (device clock synced to ours), in ms."""
+
+    def __init__(self):
+        self.last = None
+        self.avg = None
+        self.min = None
+        self.max = None
+        self.count = 0
+
+    def add(self, ms):
+        self.last = ms
+        self.avg = ms if self.avg is None else 0.9 * self.avg + 0.1 * ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.count += 1
+
+    def stats(self):
+        return {"last_ms": self.last, "avg_ms": self.avg, "min_ms": self.min, "max_ms": self.max, "count": self.count}
+
+
+class Manifest:
+    """
+    Capabilities a device publishes (retained) on devices/<id>/manifest: its
+    sensors and actuators, each with a numeric field id. Compact telemetry
+    ("v": values in field id order) is mapped back to keys with `keys`.
+    """
+
+    ACTUATORS = ("relay", "dimmer")
+
+    def __init__(self, data):
+        self.version = data.get("version")
+        self.fields = sorted(data.get("fields") or [], key=lambda f: f["id"])
+        self.keys = tuple(f["key"] for f in self.fields)
+        self.by_key = {f["key"]: f for f in self.fields}
+
+    def sensors(self):
+        """Plain sensor fields (aggregate "stat" fields like temp_max are left out)."""
+        return [f for f in self.fields if f.get("kind", "sensor") == "sensor"]
+
+    def actuators(self):
+        return [f for f in self.fields if f.get("kind") in self.ACTUATORS]
+
+    def decode(self, values):
+        """Compact value array -> {key: value}, missing (null) values left out."""
+        return {key: value for key, value in zip(self.keys, values) if value is not None}
+
+
+def fleet_metrics(diagnostics, sequences, latencies):
+    """
+    One row per device: its last diagnostics report (loop/mqtt timing in ms,
+    heap, GC, RSSI, reconnects, round trip, age of the report in seconds)
+    with the telemetry loss and latency seen by the hub.
+    """
+    now = time.time()
+    metrics = {}
+    # Snapshots: paho's network threads add devices to these dicts while we read
+    for dev_id in set(tuple(diagnostics)) | set(tuple(sequences)) | set(tuple(latencies)):
+        row = dict(diagnostics.get(dev_id) or {})
+        if "received" in row:
+            row["age"] = now - row.pop("received")
+        tracker = sequences.get(dev_id)
+        if tracker:
+            row["loss_rate"] = tracker.loss_rate()
+        stats = latencies.get(dev_id)
+        if stats:
+            row["latency_ms"] = stats.stats()["avg_ms"]
+        metrics[dev_id] = row
+    return metrics
+
+
+def now_ms():
+    return time.time_ns() // 1000000
+
+
+class CommandStream:
+    """
+    Latest-value-wins stream of one command (sliders, dimmers). At most `rate`
+    messages per second are published; positions pushed in between overwrite
+    each other and the last value is always delivered when its slot comes up.
+    """
+
+    def __init__(self, device, target_id, command, rate=10):
+        self.device = device
+        self.target_id = target_id
+        self.command = command
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.pending = None
+        self.has_pending = False
+        self.last_sent = 0.0
+        self.timer = None
+        self.sent = 0
+        self.dropped = 0
+        self.delivered = None  # False when the last value was refused (target offline)
+
+    def push(self, value):
+        with self.lock:
+            if self.has_pending:
+                self.dropped += 1
+            self.pending = value
+            self.has_pending = True
+            if self.timer:
+                return
+            wait = self.last_sent + self.interval - time.monotonic()
+            if wait > 0:
+                self.timer = threading.Timer(wait, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Sends the pending value now, if any."""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.has_pending:
+                return
+            value = self.pending
+            self.has_pending = False
+            self.last_sent = time.monotonic()
+            self.sent += 1
+        self.delivered = self.device.send_command(self.target_id, self.command, value)
+
+    def cancel(self):
+        """Stops the pending timer and drops the value waiting for it (the stream is being replaced)."""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.has_pending = False
+
+
 class IoTDevice:
     def __init__(self, device_id, broker, port=1883):
         self.id = device_id
@@ -14,56 +282,310 @@ class IoTDevice:
         self.cmd_topic = f"devices/{device_id}/commands"
         self.on_command_received = None
         self.on_telemetry_received = None
+        self.on_replay_received = None  # on_replay_received(dev_id, data, ts): frames buffered during an outage
+        self.on_ack_received = None
+        self.on_presence_changed = None  # on_presence_changed(dev_id, online)
+        self.presence = PresenceIndex()
+        self.sequences = {}  # dev_id -> SequenceTracker
+        self.latencies = {}  # dev_id -> LatencyStats
+        self.manifests = {}  # dev_id -> Manifest
+        self.on_manifest_received = None  # on_manifest_received(dev_id, manifest)
+        self.undecoded = 0  # compact frames dropped for lack of a matching manifest
+        self.replayed = 0  # frames received in batches after a device outage
+        self.diagnostics = {}  # dev_id -> last devices/<id>/diag report (+ "received")
+        self.on_diagnostics_received = None  # on_diagnostics_received(dev_id, data)
+
+        # Our own telemetry sequence, the boot id tells receivers we restarted
+        self.seq = 0
+        self.boot_id = random.getrandbits(32)
 
         self.current_telemetry_topic = None
+        self.fleet_topics = set()
+        self.streams = {}
+
+        # Connection events: "connected", "disconnected" or "reconnecting"
+        self.on_connection_state = None
+        self.state = "disconnected"
+        self._closing = False
+
+        # Broker round-trip probe
+        self.on_link_quality = None  # on_link_quality(rtt_ms, degraded)
+        self.rtt_ms = None
+        self.degraded = False
+        self._probe_seq = 0
+        self._probe_sent = None  # (seq, perf_counter) of the outstanding probe
+        self._probe_stop = None
 
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_connect_fail = self._on_connect_fail
         self.client.on_message = self._on_message
 
+    @property
+    def probe_topic(self):
+        return f"devices/{self.id}/probe"
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        print(f"SDK: Connection {state}")
+        if self.on_connection_state:
+            self.on_connection_state(state)
+
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             print(f"SDK: Connected! Subscribing to {self.cmd_topic}")
             client.subscribe(self.cmd_topic)
+            client.subscribe("devices/+/ack")
+            client.subscribe("devices/+/status")
+            client.subscribe("devices/+/time")
+            client.subscribe("devices/+/manifest")
+            client.subscribe("devices/+/diag")
+            client.subscribe(self.probe_topic)
 
             # Re-subscribe to telemetry topic if one is already set
             # This handles both initial connect and reconnects
             if self.current_telemetry_topic:
                 print(f"SDK: Re-subscribing to {self.current_telemetry_topic}")
                 client.subscribe(self.current_telemetry_topic)
+
+            if self.fleet_topics:
+                print(f"SDK: Re-subscribing to {len(self.fleet_topics)} fleet topics")
+                client.subscribe([(t, 0) for t in self.fleet_topics])
+            self._set_state("connected")
         else:
             print(f"SDK: Connection failed with rc={rc}")
+            self._set_state("reconnecting")
+
+    def _on_disconnect(self, client, userdata, flags, rc, properties=None):
+        self._probe_sent = None
+        self._set_state("disconnected")
+        # paho's network loop retries on its own unless we asked to close
+        if not self._closing:
+            self._set_state("reconnecting")
+
+    def _on_connect_fail(self, client, userdata):
+        if not self._closing:
+            self._set_state("reconnecting")
 
     def _on_message(self, client, userdata, msg):
+        received = now_ms()
         try:
             data = json.loads(msg.payload.decode())
 
-            if "commands" in msg.topic and self.on_command_received:
-                self.on_command_received(data.get("command"), data.get("value"))
+            if msg.topic.endswith("/time"):
+                self._answer_time(msg.topic.split("/")[1], data, received)
+
+            elif msg.topic == self.probe_topic:
+                self._on_probe(data)
+
+            elif "commands" in msg.topic and self.on_command_received:
+                if isinstance(data.get("commands"), dict):
+                    for command, value in data["commands"].items():
+                        self.on_command_received(command, value)
+                else:
+                    self.on_command_received(data.get("command"), data.get("value"))
+
+            elif msg.topic.endswith("/status"):
+                self._set_presence(msg.topic.split("/")[1], bool(data.get("online")))
+
+            elif msg.topic.endswith("/manifest"):
+                self._set_manifest(msg.topic.split("/")[1], data)
+
+            elif msg.topic.endswith("/diag"):
+                self._set_diagnostics(msg.topic.split("/")[1], data)
+
+            elif msg.topic.endswith("/ack") and self.on_ack_received:
+                self.on_ack_received(msg.topic.split("/")[1], data)
 
             elif "telemetry" in msg.topic and self.on_telemetry_received:
                 sender_id = msg.topic.split("/")[1]
-                self.on_telemetry_received(sender_id, data.get("data"), data.get("ts"))
+                self._set_presence(sender_id, True)
+                if "batch" in data:
+                    # Frames buffered by the device during an outage, oldest first
+                    for frame in data["batch"]:
+                        frame.setdefault("boot", data.get("boot"))
+                        frame.setdefault("mv", data.get("mv"))
+                        if self._on_telemetry(sender_id, frame, None, replayed=True):
+                            self.replayed += 1
+                else:
+                    self._on_telemetry(sender_id, data, received)
 
         except Exception as e:
             print(f"SDK JSON Error: {e}")
 
+    def _on_telemetry(self, sender_id, data, received, replayed=False):
+        """
+        One telemetry frame, `received` is None for replayed frames (no latency
+        sample). Replayed frames go to on_replay_received when it is set: they
+        are history, not the device's current state. False when dropped:
+        duplicates (also a replayed copy of a frame that did get through) or no
+        matching manifest.
+        """
+        if "seq" in data and not self._track_sequence(sender_id, data):
+            return False  # duplicate frame
+        ts = data.get("ts")
+        if data.get("sync") and ts is not None:
+            if received is not None:
+                self._track_latency(sender_id, received - ts)
+            ts = ts / 1000
+        else:
+            ts = None  # device uptime, not comparable with our clock
+        values = data.get("data")
+        if values is None and "v" in data:
+            values = self._decode(sender_id, data)
+            if values is None:
+                return False
+        if replayed and self.on_replay_received:
+            self.on_replay_received(sender_id, values, ts)
+        else:
+            self.on_telemetry_received(sender_id, values, ts)
+        return True
+
+    def _track_sequence(self, dev_id, data):
+        tracker = self.sequences.get(dev_id)
+        if tracker is None:
+            tracker = self.sequences[dev_id] = SequenceTracker()
+        return tracker.accept(data["seq"], data.get("boot"))
+
+    def link_stats(self, dev_id):
+        """Loss, duplicate and reorder counters of one device, None if it never sent a sequence number."""
+        tracker = self.sequences.get(dev_id)
+        return tracker.stats() if tracker else None
+
+    def link_metrics(self):
+        return {dev_id: tracker.stats() for dev_id, tracker in tuple(self.sequences.items())}
+
+    # ---------------- Manifests ----------------
+    def _set_manifest(self, dev_id, data):
+        if not data.get("fields"):
+            self.manifests.pop(dev_id, None)  # retained manifest cleared
+            return
+        manifest = self.manifests[dev_id] = Manifest(data)
+        print(f"SDK: Manifest of {dev_id}: {len(manifest.fields)} fields")
+        if self.on_manifest_received:
+            self.on_manifest_received(dev_id, manifest)
+
+    def _decode(self, dev_id, data):
+        manifest = self.manifests.get(dev_id)
+        if manifest is None or manifest.version != data.get("mv"):
+            self.undecoded += 1
+            return None
+        return manifest.decode(data["v"])
+
+    # ---------------- Diagnostics ----------------
+    def _set_diagnostics(self, dev_id, data):
+        data["received"] = time.time()
+        self.diagnostics[dev_id] = data
+        if self.on_diagnostics_received:
+            self.on_diagnostics_received(dev_id, data)
+
+    def fleet_metrics(self):
+        return fleet_metrics(self.diagnostics, self.sequences, self.latencies)
+
+    # ---------------- Clock sync ----------------
+    def _answer_time(self, dev_id, data, received):
+        """
+        Hub side of the NTP-style exchange: the device sends t0 (its clock), we
+        answer with t1 (request received) and t2 (reply sent) in epoch ms. The
+        device derives its offset and skew from the four timestamps.
+        """
+        if "t0" not in data or "t1" in data:
+            return
+        reply = {"t0": data["t0"], "t1": received, "t2": now_ms()}
+        self.client.publish(f"devices/{dev_id}/time/reply", json.dumps(reply))
+
+    def _track_latency(self, dev_id, ms):
+        stats = self.latencies.get(dev_id)
+        if stats is None:
+            stats = self.latencies[dev_id] = LatencyStats()
+        stats.add(ms)
+
+    def latency(self, dev_id):
+        """End-to-end latency of one device's telemetry, None until it sends synced timestamps."""
+        stats = self.latencies.get(dev_id)
+        return stats.stats() if stats else None
+
+    def latency_metrics(self):
+        return {dev_id: stats.stats() for dev_id, stats in tuple(self.latencies.items())}
+
+    def _set_presence(self, dev_id, online):
+        if self.presence.update(dev_id, online) and self.on_presence_changed:
+            self.on_presence_changed(dev_id, online)
+
     def connect(self):
+        self._closing = False
+        self._set_state("reconnecting")
         try:
-            self.client.connect(self.broker, self.port, keepalive=60)
+            # connect_async lets paho's loop keep retrying if the broker is down
+            self.client.connect_async(self.broker, self.port, keepalive=60)
             self.client.loop_start()
         except Exception as e:
             print(f"SDK Connect Error: {e}")
 
     def disconnect(self):
+        self._closing = True
         try:
-            self.client.loop_stop()
             self.client.disconnect()
+            self.client.loop_stop()
         except Exception:
             pass
+        self._set_state("disconnected")
+
+    # ---------------- Round-trip probe ----------------
+    def start_probe(self, interval=5, timeout=3, degraded_ms=500):
+        """
+        Publishes a small probe to our own topic every `interval` seconds and times
+        its way back through the broker. The link is reported degraded when the
+        round trip exceeds `degraded_ms` or a probe gets no answer within `timeout`.
+        """
+        self.stop_probe()
+        self.probe_timeout = timeout
+        self.degraded_ms = degraded_ms
+        stop = self._probe_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self._send_probe()
+
+        threading.Thread(target=run, name="rtt-probe", daemon=True).start()
+
+    def stop_probe(self):
+        if self._probe_stop:
+            self._probe_stop.set()
+            self._probe_stop = None
+
+    def _send_probe(self):
+        if not self.client.is_connected():
+            return
+        pending = self._probe_sent
+        if pending and time.perf_counter() - pending[1] > self.probe_timeout:
+            # Previous probe never came back
+            self._report_link(None, True)
+        self._probe_seq += 1
+        self._probe_sent = (self._probe_seq, time.perf_counter())
+        self.client.publish(self.probe_topic, json.dumps({"n": self._probe_seq}))
+
+    def _on_probe(self, data):
+        pending = self._probe_sent
+        if not pending or data.get("n") != pending[0]:
+            return
+        self._probe_sent = None
+        rtt = (time.perf_counter() - pending[1]) * 1000
+        # Smooth a little so a single slow probe doesn't flicker the UI
+        self.rtt_ms = rtt if self.rtt_ms is None else 0.7 * self.rtt_ms + 0.3 * rtt
+        self._report_link(self.rtt_ms, self.rtt_ms > self.degraded_ms)
+
+    def _report_link(self, rtt_ms, degraded):
+        self.degraded = degraded
+        if self.on_link_quality:
+            self.on_link_quality(rtt_ms, degraded)
 
     def send_telemetry(self, sensor_data):
         topic = f"devices/{self.id}/telemetry"
-        payload = {"ts": int(time.time()), "data": sensor_data}
+        payload = {"ts": now_ms(), "sync": True, "seq": self.seq, "boot": self.boot_id, "data": sensor_data}
+        self.seq += 1
         self.client.publish(topic, json.dumps(payload))
 
     def subscribe_telemetry(self, target_id):
@@ -74,25 +596,387 @@ class IoTDevice:
         topic = f"devices/{target_id}/telemetry"
 
         # Unsubscribe from old topic if switching devices
-        if self.current_telemetry_topic and self.current_telemetry_topic != topic:
-            print("SDK: Unsubscribing from", self.current_telemetry_topic)
-            self.client.unsubscribe(self.current_telemetry_topic)
+        # (topics of the fleet subscription are kept)
+        old = self.current_telemetry_topic
+        if old and old != topic and old not in self.fleet_topics:
+            print("SDK: Unsubscribing from", old)
+            self.client.unsubscribe(old)
 
         self.current_telemetry_topic = topic
 
         # Only subscribe immediately if already connected,
         # otherwise _on_connect handles it when connection is ready
+        if topic in self.fleet_topics:
+            return
         if self.client.is_connected():
             print("SDK: Subscribing to", topic)
             self.client.subscribe(topic)
         else:
             print("SDK: Topic queued for subscribe on connect:", topic)
 
-    def send_command(self, target_id, command, value):
+    def unsubscribe_telemetry(self):
+        """Drops the telemetry target (the focus moved to a device on another broker)."""
+        old = self.current_telemetry_topic
+        self.current_telemetry_topic = None
+        if old and old not in self.fleet_topics and self.client.is_connected():
+            self.client.unsubscribe(old)
+
+    def subscribe_fleet(self, device_ids):
+        """
+        Subscribe to the telemetry of every device in `device_ids` with a single
+        SUBSCRIBE packet. Only the difference with the previous set is sent.
+        """
+        topics = {f"devices/{d}/telemetry" for d in device_ids}
+        added = topics - self.fleet_topics
+        removed = self.fleet_topics - topics - {self.current_telemetry_topic}
+        self.fleet_topics = topics
+
+        if not self.client.is_connected():
+            return
+        if removed:
+            self.client.unsubscribe(list(removed))
+        if added:
+            print(f"SDK: Subscribing to {len(added)} fleet topics")
+            self.client.subscribe([(t, 0) for t in added])
+
+    def send_command(self, target_id, command, value, force=False):
+        """Returns False without publishing when the target is known to be offline (unless `force`)."""
+        if not force and self.presence.is_offline(target_id):
+            print(f"SDK: {target_id} is offline, dropping command {command}")
+            return False
         topic = f"devices/{target_id}/commands"
         payload = {"command": command, "value": value}
         self.client.publish(topic, json.dumps(payload))
+        return True
+
+    def send_scene(self, target_id, commands, name=None, force=False):
+        """Sends a {command: value} map as one message, applied and acknowledged once by the device."""
+        if not force and self.presence.is_offline(target_id):
+            print(f"SDK: {target_id} is offline, dropping scene {name}")
+            return False
+        topic = f"devices/{target_id}/commands"
+        payload = {"scene": name, "commands": commands}
+        self.client.publish(topic, json.dumps(payload))
+        return True
+
+    def stream(self, target_id, command, rate=10):
+        """Returns the throttled CommandStream of `command` on `target_id`."""
+        key = (target_id, command)
+        stream = self.streams.get(key)
+        if stream is None or stream.interval != 1.0 / rate:
+            old = stream
+            stream = self.streams[key] = CommandStream(self, target_id, command, rate)
+            if old is not None:
+                # New rate: the old timer must not send a stale value after the new stream starts
+                old.cancel()
+                stream.last_sent = old.last_sent
+        return stream
 
     def is_connected(self):
         """Returns True if the MQTT client is currently connected to the broker."""
-        return self.client.is_connected()
\ No newline at end of file
+        return self.client.is_connected()
+
+
+def parse_broker(text, default_port=1883):
+    """'host' or 'host:port' -> (host, port)."""
+    host, sep, port = text.strip().rpartition(":")
+    if not sep:
+        return port, default_port
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid broker: {text}")
+    return host, int(port)
+
+
+class HubPool:
+    """
+    One persistent IoTDevice connection per broker (site), with every device
+    routed to the broker it lives on. Devices without a route use the default
+    broker. Connections reconnect on their own with a randomised backoff, so a
+    site going down never restarts the others and sites don't retry in lockstep.
+    Connections are only opened by connect() and set_route(); publishing to a
+    site without one returns False.
+    Presence, sequence, latency and diagnostics tracking is shared by all connections.
+    """
+
+    def __init__(self, device_id, broker, port=1883):
+        self.id = device_id
+        self.default = (broker, port)
+        self.hubs = {}    # (broker, port) -> IoTDevice
+        self.routes = {}  # dev_id -> (broker, port), only for devices with an explicit broker
+        self.lock = threading.RLock()  # opening/closing connections (UI, paho and scheduler threads)
+        self.streams = {}
+        self.focus = None
+        self.fleet = set()
+        self.started = False
+        self.probe = None  # start_probe() arguments, applied to new connections too
+
+        self.presence = PresenceIndex()
+        self.sequences = {}
+        self.latencies = {}
+        self.manifests = {}
+        self.diagnostics = {}
+
+        self.on_telemetry_received = None
+        self.on_replay_received = None
+        self.on_ack_received = None
+        self.on_manifest_received = None
+        self.on_diagnostics_received = None
+        self.on_presence_changed = None
+        self.on_connection_state = None  # aggregate: "connected" (all brokers), "partial" (some, see sites_up)...
+        self.on_broker_state = None      # on_broker_state((broker, port), state)
+        self.on_link_quality = None      # worst round trip of all brokers
+        self.state = "disconnected"
+        self.sites_up = (0, 0)  # (connected brokers, open connections)
+        self.rtt_ms = None
+        self.degraded = False
+
+    # ---------------- Routing ----------------
+    def key_for(self, dev_id):
+        return self.routes.get(dev_id, self.default)
+
+    def hub_for(self, dev_id):
+        """The open connection of the device's site, None if there is none (never opens one)."""
+        return self.hubs.get(self.key_for(dev_id))
+
+    def set_route(self, dev_id, broker=None, port=1883):
+        """
+        Moves a device to another broker, None for the default one. An explicit
+        broker is kept even when it equals the default, like in the registry, so
+        the device stays there when the default broker changes.
+        """
+        key = (broker, port) if broker else None
+        if self.routes.get(dev_id) == key:
+            return
+        if key:
+            self.routes[dev_id] = key
+        else:
+            self.routes.pop(dev_id, None)
+        if self.started:
+            self._sync()
+
+    def forget(self, dev_id):
+        self.set_route(dev_id, None)
+
+    def sites(self):
+        return {self.default} | set(self.routes.values())
+
+    def _open(self, key):
+        """Connection of one site, created if needed. Only called from _sync() with the lock held."""
+        hub = self.hubs.get(key)
+        if hub is not None:
+            return hub
+        hub = self.hubs[key] = IoTDevice(self.id, key[0], key[1])
+        hub.presence = self.presence
+        hub.sequences = self.sequences
+        hub.latencies = self.latencies
+        hub.manifests = self.manifests
+        hub.diagnostics = self.diagnostics
+        hub.on_manifest_received = self._on_manifest
+        hub.on_diagnostics_received = self._on_diagnostics
+        hub.on_telemetry_received = self._on_telemetry
+        hub.on_replay_received = self._on_replay
+        hub.on_ack_received = self._on_ack
+        hub.on_presence_changed = self._on_presence
+        hub.on_connection_state = lambda state: self._on_hub_state(key, state)
+        hub.on_link_quality = lambda rtt, degraded: self._on_hub_link()
+        # Jittered backoff: brokers that dropped together don't come back in lockstep
+        hub.client.reconnect_delay_set(min_delay=random.uniform(1, 3), max_delay=60)
+        return hub
+
+    def _sync(self):
+        """Opens a connection for every site in use, closes the ones no longer needed."""
+        with self.lock:
+            wanted = self.sites()
+            for key in list(self.hubs):
+                if key not in wanted:
+                    print(f"SDK: Closing connection to {key[0]}:{key[1]}")
+                    hub = self.hubs.pop(key)
+                    hub.stop_probe()
+                    hub.disconnect()
+            for key in wanted:
+                hub = self._open(key)
+                if hub.state == "disconnected":
+                    hub.connect()
+                    if self.probe is not None:
+                        hub.start_probe(**self.probe)
+            self._subscribe()
+        self._on_hub_state(None, None)
+
+    # ---------------- Connections ----------------
+    def connect(self):
+        self.started = True
+        self._sync()
+
+    def disconnect(self):
+        with self.lock:
+            self.started = False
+            for hub in list(self.hubs.values()):
+                hub.stop_probe()
+                hub.disconnect()
+            self.hubs.clear()
+        self._set_state("disconnected", (0, 0))
+
+    def reconfigure(self, device_id, broker, port=1883):
+        """
+        Applies new settings. Only the connections whose broker (or our id) changed
+        are torn down, the other sites stay connected.
+        """
+        if device_id != self.id:
+            self.disconnect()
+        self.id = device_id
+        self.default = (broker, port)
+        self.connect()
+
+    def _on_hub_state(self, key, state):
+        if key is not None and self.on_broker_state:
+            self.on_broker_state(key, state)
+        states = [hub.state for hub in tuple(self.hubs.values())]
+        up = states.count("connected")
+        # Sites are independent: one broker down only makes the pool "partial"
+        if states and up == len(states):
+            state = "connected"
+        elif up:
+            state = "partial"
+        elif "reconnecting" in states:
+            state = "reconnecting"
+        else:
+            state = "disconnected"
+        self._set_state(state, (up, len(states)))
+
+    def _set_state(self, state, sites_up=None):
+        sites_up = self.sites_up if sites_up is None else sites_up
+        if state == self.state and sites_up == self.sites_up:
+            return
+        self.state = state
+        self.sites_up = sites_up
+        if self.on_connection_state:
+            self.on_connection_state(state)
+
+    def _on_hub_link(self):
+        hubs = tuple(self.hubs.values())
+        rtts = [hub.rtt_ms for hub in hubs if hub.rtt_ms is not None]
+        self.rtt_ms = max(rtts) if rtts else None
+        self.degraded = any(hub.degraded for hub in hubs)
+        if self.on_link_quality:
+            self.on_link_quality(self.rtt_ms, self.degraded)
+
+    def is_connected(self):
+        return bool(self.hubs) and all(hub.is_connected() for hub in tuple(self.hubs.values()))
+
+    def start_probe(self, **kwargs):
+        self.probe = kwargs
+        for hub in tuple(self.hubs.values()):
+            hub.start_probe(**kwargs)
+
+    def stop_probe(self):
+        self.probe = None
+        for hub in tuple(self.hubs.values()):
+            hub.stop_probe()
+
+    # ---------------- Callbacks from the connections ----------------
+    def _on_telemetry(self, dev_id, data, ts):
+        if self.on_telemetry_received:
+            self.on_telemetry_received(dev_id, data, ts)
+
+    def _on_replay(self, dev_id, data, ts):
+        if self.on_replay_received:
+            self.on_replay_received(dev_id, data, ts)
+        else:
+            self._on_telemetry(dev_id, data, ts)
+
+    def _on_manifest(self, dev_id, manifest):
+        if self.on_manifest_received:
+            self.on_manifest_received(dev_id, manifest)
+
+    def _on_diagnostics(self, dev_id, data):
+        if self.on_diagnostics_received:
+            self.on_diagnostics_received(dev_id, data)
+
+    def _on_ack(self, dev_id, data):
+        if self.on_ack_received:
+            self.on_ack_received(dev_id, data)
+
+    def _on_presence(self, dev_id, online):
+        if self.on_presence_changed:
+            self.on_presence_changed(dev_id, online)
+
+    # ---------------- Subscriptions ----------------
+    def subscribe_telemetry(self, target_id):
+        self.focus = target_id
+        if self.started:
+            self._subscribe()
+
+    def subscribe_fleet(self, device_ids):
+        self.fleet = set(device_ids)
+        if self.started:
+            self._subscribe()
+
+    def _subscribe(self):
+        groups = {}
+        for dev_id in self.fleet:
+            groups.setdefault(self.key_for(dev_id), set()).add(dev_id)
+        focus_key = self.key_for(self.focus) if self.focus else None
+        for key, hub in tuple(self.hubs.items()):
+            hub.subscribe_fleet(groups.get(key, ()))
+            if key == focus_key:
+                hub.subscribe_telemetry(self.focus)
+            else:
+                hub.unsubscribe_telemetry()
+
+    # ---------------- Publishing ----------------
+    def send_command(self, target_id, command, value, force=False):
+        hub = self.hub_for(target_id)
+        if hub is None:
+            print(f"SDK: no connection for {target_id}, dropping command {command}")
+            return False
+        return hub.send_command(target_id, command, value, force)
+
+    def send_scene(self, target_id, commands, name=None, force=False):
+        hub = self.hub_for(target_id)
+        if hub is None:
+            print(f"SDK: no connection for {target_id}, dropping scene {name}")
+            return False
+        return hub.send_scene(target_id, commands, name, force)
+
+    def stream(self, target_id, command, rate=10):
+        """Throttled CommandStream, resolving the device's connection on every send."""
+        key = (target_id, command)
+        stream = self.streams.get(key)
+        if stream is None or stream.interval != 1.0 / rate:
+            old = stream
+            stream = self.streams[key] = CommandStream(self, target_id, command, rate)
+            if old is not None:
+                # New rate: the old timer must not send a stale value after the new stream starts
+                old.cancel()
+                stream.last_sent = old.last_sent
+        return stream
+
+    def send_telemetry(self, sensor_data):
+        hub = self.hubs.get(self.default)
+        if hub is None:
+            return False
+        hub.send_telemetry(sensor_data)
+        return True
+
+    # ---------------- Metrics ----------------
+    def link_stats(self, dev_id):
+        tracker = self.sequences.get(dev_id)
+        return tracker.stats() if tracker else None
+
+    def link_metrics(self):
+        return {dev_id: tracker.stats() for dev_id, tracker in tuple(self.sequences.items())}
+
+    def latency(self, dev_id):
+        stats = self.latencies.get(dev_id)
+        return stats.stats() if stats else None
+
+    def latency_metrics(self):
+        return {dev_id: stats.stats() for dev_id, stats in tuple(self.latencies.items())}
+
+    def fleet_metrics(self):
+        """Per-device diagnostics with loss and latency, see fleet_metrics()."""
+        return fleet_metrics(self.diagnostics, self.sequences, self.latencies)
+
+    def broker_states(self):
+        """{'host:port': state} of every open connection."""
+        return {f"{key[0]}:{key[1]}": hub.state for key, hub in tuple(self.hubs.items())}
\ No newline at end of file